@@ -1,14 +1,146 @@
 from playwright.sync_api import sync_playwright
 from playwright._impl._cdp_session import CDPSession
 import AccessibilityTree
+import ContextPacker
 import json
+import contextlib
 import LLMAgent
 import re
 import time
 import VisionAgent
 import Settings
+import CommandMemo
+import PageLayout
+import PageReadiness
+import ScreenCapture
+import SpeculativeVision
+import Tracing
+import TreeDelta
+
+
+#Resolved commands reused on repeat runs
+command_memo = CommandMemo.CommandMemo(Settings.Command_Memo_Path) if Settings.UseCommandMemo else None
+
+#Extract the parameters of a command, e.g. Input(22,Burger) -> ['22', 'Burger']
+def get_command_params(command):
+    pattern = r"(?<=\().+?(?=\))"
+    match = re.search(pattern, command)
+    params = []
+    if match:
+        extracted_string = match.group()
+        params = extracted_string.split(",")
+    return params
+
+#Adds the seconds spent in the block to timings[stage] and traces it as a span
+@contextlib.contextmanager
+def timed(timings,stage):
+    start = time.perf_counter()
+    try:
+        with Tracing.span(stage):
+            yield
+    finally:
+        timings[stage] = timings.get(stage, 0) + time.perf_counter() - start
+
+#Everything after the "Instructions:" title of a plan, one instruction per line
+def get_instructions(prompt):
+    return prompt[prompt.lower().find("instructions:") + 13:].split('\n')
+
+#Every command ExecuteCommand knows, in the order it looks for them, with the number of parameters each needs
+COMMANDS = (("Input", 2), ("Navigate", 1), ("Click", 1), ("Find", 1), ("EndTask", 0), ("Scroll", 0), ("Expand", 1), ("Read", 1), ("Enter", 0))
+
+#The command ExecuteCommand runs for a command and its parameters, e.g. "1. Click(88)" -> ('Click', ['88']), the name is None for an unknown command
+def parse_command(command):
+    params = get_command_params(command)
+    for name, param_count in COMMANDS:
+        if command.find(name) != -1 and len(params) >= param_count:
+            return name, params
+    return None, params
+
+#Commands that act on the page in place, a response may chain several of them for the next instructions
+BATCHABLE_COMMANDS = ("Input", "Click", "Enter", "Read")
+
+#Every command of a response in order, see LLMAgent.parse_commands
+def get_commands(command_plan):
+    return LLMAgent.parse_commands(command_plan)
+
+#The indexes of up to count instructions after step, a loop instruction ends them
+def next_steps(instruction_list,step,count):
+    steps = []
+    for i in range(step + 1, len(instruction_list)):
+        if len(steps) == count or instruction_list[i].lower().find("loop") == 0:
+            break
+        if len(instruction_list[i]) >= 3:
+            steps.append(i)
+    return steps
+
+
+#Why a command agent answer should go to a bigger model, None when it can be used
+def command_trigger(command_plan,tree):
+    commands = get_commands(command_plan)
+    if not commands:
+        return "parse"
+    command = commands[0]
+    if command.lower().startswith("exception"):
+        return "not_found"
+    name, params = parse_command(command)
+    if name is None:
+        return "parse"
+    if name in CommandMemo.NODE_COMMANDS and tree.getNodeByDomId(params[0]) is None:
+        return "missing_node"
+    return None
+
+
+def batch_commands(command_plan,steps,url):
+    """
+    Pair the extra commands of a response with the next instructions they resolve.
+
+    The chain ends at the first command that is not batchable, since a Navigate, Scroll or Find changes
+    what the commands after it would have to be resolved against.
+
+    Args:
+        command_plan (str): The response of the command agent.
+        steps (list): The indexes of the next instructions the response was given.
+        url (str): The URL of the page the response was made for.
+
+    Returns:
+        list: (step, command, url) of every extra command, in order.
+    """
+    commands = get_commands(command_plan)
+    batch = []
+    for previous, command, step in zip(commands, commands[1:], steps):
+        if parse_command(previous)[0] not in BATCHABLE_COMMANDS or parse_command(command)[0] not in BATCHABLE_COMMANDS:
+            break
+        batch.append((step, command, url))
+    return batch
+
 
+def next_batched_command(batch,step,url,tree):
+    """
+    Take the batched command of a step if it can still run on the current page.
 
+    The rest of the batch is dropped once the page navigated away from the URL the response was made
+    for, or the node a command acts on is no longer in the tree.
+
+    Args:
+        batch (list): The remaining (step, command, url) of the last response.
+        step (int): The index of the current instruction.
+        url (str): The current URL.
+        tree (AccessibilityTree): The current accessibility tree.
+
+    Returns:
+        str: The command plan of the step, or None if the command agent has to be asked.
+    """
+    if not batch or batch[0][0] != step:
+        batch.clear()
+        return None
+    _, command, batch_url = batch.pop(0)
+    name, params = parse_command(command)
+    node_gone = name in CommandMemo.NODE_COMMANDS and tree.getNodeByDomId(params[0]) is None
+    if url != batch_url or node_gone:
+        print("The page changed, dropping the rest of the batched commands")
+        batch.clear()
+        return None
+    return "Thought:\nResolved together with the previous instruction\nCommand: " + command
 
 
 class AgentBrowser:
@@ -16,31 +148,54 @@ class AgentBrowser:
     AgentBrowser class for controlling a browser agent to interact with elements in an accessibility tree.
 
     Functions:
-    - OutputPage(index=0): Get the output of the website's accessibility tree.
+    - OutputPage(index=0, instruction=None): Get the output of the website's accessibility tree.
     - Focus(id): Focus on a specific element by its ID.
     - LoadPage(): Load the page and initialize the accessibility tree.
     - Navigate(url="https://example.com"): Navigate to a specified URL.
     - Expand(params): Expand a node in the accessibility tree.
+    - LoadLayout(): Read the layout boxes the tree is paged by with Settings.UseViewportPaging.
     - Scroll(): Scroll down the page.
     - Click(params): Click on a specific element.
     - Read(params): Read text content of a specific element.
+    - Find(params): Search every node in the accessibility tree.
     - Enter(): Simulate pressing the Enter key.
     - input_command(params): Input text into a specific element.
+    - CreateCommands(com_prompt, count, history): Ask the command agent, through the model cascade when it is on.
     - ExecuteCommand(command): Execute the given command.
-    - AgentLoop(): Main loop for planner and command creation communication.
+    - PageChanged(): Start summarizing the current page in the background.
+    - AgentLoop(): Main loop prompting for tasks.
+    - run_task(prompt): Planner and command creation communication for a single task.
+    - StartAttempt(prompt): Reset the state of an attempt.
+    - PrepareStep(i, instruction): Resolve a command without the command agent or build its request.
+    - CommandsAnswered(command_plan): Keep the batched commands of a response.
+    - RememberCommand(instruction, command): Capture a command for the command memo.
+    - StoreCommands(): Store the commands of a completed attempt in the command memo.
+    - StepOutcome(instruction, command): Decide how the task goes on after a command.
+    - LogReasoning(i, instruction, command_plan): Add a command agent output to the reasoning history.
+    - UpdateTree(): Wait for the page and update the accessibility tree after a command.
+    - UpdatePlan(prompt): Summarize the page and ask the updater for a new plan.
     """
-    browser = None
-    page = None
-    client = None
-    accessibility_tree = None
-    current_url = "https://example.com"
-    last_result = "(Start of task): No command has been executed yet"
-    last_instruction = "No last instruction task has begun"
-    website_name = "UNKNOWN SITE"
-    original_prompt = ""
-    reasoning_history = []
-
-    def __init__(self):
+    def __init__(self,page=None,screenshot_path=None):
+        self.browser = None
+        self.page = page
+        self.client = None
+        self.accessibility_tree = None
+        self.current_url = "https://example.com"
+        self.last_result = "(Start of task): No command has been executed yet"
+        self.last_instruction = "No last instruction task has begun"
+        self.website_name = "UNKNOWN SITE"
+        self.original_prompt = ""
+        self.reasoning_history = []
+        self.screenshot_path = screenshot_path
+        #Summarizes each new page in the background so the updater does not wait for the vision model
+        self.speculative_vision = SpeculativeVision.SpeculativeVision() if Settings.UseSpeculativeVision and Settings.UseUpdater else None
+        #Sends the command agent the full tree once per page and only the changes after that
+        self.tree_conversation = TreeDelta.TreeConversation() if Settings.UseTreeDeltas else None
+        self.trace = []
+        self.timings = {}
+        if page is not None:
+            #Attached to a page owned by the caller, tasks are run through run_task
+            return
         with sync_playwright() as p:
             self.browser = p.chromium.launch(channel="chrome", headless=Settings.Headless)
             self.page = self.browser.new_page()
@@ -50,17 +205,23 @@ class AgentBrowser:
         self.browser.close()
 
     #Functions
-    def OutputPage(self,index=0):
+    def OutputPage(self,index=0,instruction=None):
         """
         Return the output of the website's accessibility tree up to a specified character limit.
 
+        With Settings.UseContextPacking and an instruction, the nodes most relevant to the instruction
+        from the current chunk on are packed into Settings.Tree_Token_Budget instead.
+
         Args:
             index (int): Index parameter for the output (default is 0).
+            instruction (str): The instruction the output is for (default is None).
 
         Returns:
             str: The concatenated website name and the truncated output of the accessibility tree.
         """
-        return self.website_name + self.accessibility_tree.get_output()[:Settings.Tree_Context_Cap]
+        if Settings.UseContextPacking and instruction is not None:
+            return self.website_name + ContextPacker.pack_tree(self.accessibility_tree, instruction, Settings.Tree_Token_Budget, Settings.Context_Neighbors)
+        return self.website_name + self.accessibility_tree.get_output(Settings.Tree_Context_Cap)
     
     def Focus(self,id):
         """
@@ -82,13 +243,17 @@ class AgentBrowser:
         Returns:
             None
         """
-        self.client = self.page.context.new_cdp_session(self.page)
+        if self.client is not None:
+            self.client.detach()
+        self.client = Tracing.trace_cdp(self.page.context.new_cdp_session(self.page))
         self.client.send("Accessibility.enable")
-        snapshot = self.page.accessibility.snapshot()
+        snapshot = None if Settings.UseFullTree else self.page.accessibility.snapshot()
         self.accessibility_tree = AccessibilityTree.AccessibilityTree(self.client, snapshot)
+        self.LoadLayout()
+        if Settings.IncrementalTree:
+            self.accessibility_tree.enable_incremental(self.page.url)
         self.current_url = self.page.url
-        rootAxNode = self.client.send('Accessibility.getRootAXNode')
-        self.website_name = "Website: " + rootAxNode["node"]["name"]["value"] + '\n'
+        self.website_name = "Website: " + self.accessibility_tree.get_root_name() + '\n'
 
     def Navigate(self,url="https://example.com"):
         """
@@ -115,19 +280,36 @@ class AgentBrowser:
         Returns:
             str: The result of expanding the specified node.
         """
-        return self.accessibility_tree.expand_node(params[0])
+        node_id = params[0]
+        if self.accessibility_tree.getNodeByDomId(node_id) is None:
+            return f"Exception: Node {node_id} is not in the current tree"
+        return self.accessibility_tree.expand_node(node_id)
     
+    def LoadLayout(self):
+        """
+        Read the layout boxes of every node and the scroll position the tree is paged by, only with Settings.UseViewportPaging.
+        """
+        if not Settings.UseViewportPaging:
+            return
+        layout_snapshot = self.client.send("DOMSnapshot.captureSnapshot", PageLayout.SNAPSHOT_PARAMS)
+        self.accessibility_tree.set_layout(layout_snapshot, self.client.send("Page.getLayoutMetrics"))
+
     def Scroll(self):
         """
         Increment the chunk index for scrolling, scroll down the page, and handle reaching the end of the page.
 
+        With Settings.UseViewportPaging the page is scrolled by exactly one screen instead and the tree
+        shows the nodes on the new screen once it is reloaded.
+
         Returns:
             str: The result of the scroll operation or an exception message if the end of the page is reached.
         """
+        if Settings.UseViewportPaging and self.accessibility_tree.viewport is not None:
+            return self.ScrollViewport()
         self.accessibility_tree.chunk_index += 1
 
         scroll_to =  int(min([len(self.accessibility_tree.full_tree)-1,(self.accessibility_tree.chunk_index * self.accessibility_tree.chunk_length)]))# scroll half way
-        if len(self.accessib.ility_tree.full_tree) > scroll_to:
+        if len(self.accessibility_tree.full_tree) > scroll_to:
             return self._extracted_from_Scroll_8(scroll_to)
         self.accessibility_tree.chunk_index = 0
         return "Exception: Failed to scroll end of page reached"
@@ -145,11 +327,30 @@ class AgentBrowser:
         """
         self.page.mouse.wheel(0, 250)
         scroll_node = self.accessibility_tree.full_tree[scroll_to]
-        scroll_id = scroll_node["backendDOMNodeId"]
+        scroll_id = scroll_node.backend_id
         self.client.send('DOM.scrollIntoViewIfNeeded', {'backendNodeId': int(scroll_id)})
-        time.sleep(2)  # Allow scrolled elements to load
+        PageReadiness.wait_until_ready(self.page, self.client, Settings.Scroll_Ready_Timeout, "scroll")  # Allow scrolled elements to load
         return "Scrolled down"
     
+    def ScrollViewport(self):
+        """
+        Scroll the window down by one viewport height.
+
+        Pages that scroll an inner element instead of the window are scrolled with the mouse wheel.
+
+        Returns:
+            str: The result of the scroll operation or an exception message if the end of the page is reached.
+        """
+        top, height, page_height = self.accessibility_tree.viewport
+        if page_height > height:
+            if self.accessibility_tree.at_page_end():
+                return "Exception: Failed to scroll end of page reached"
+            self.page.evaluate("y => window.scrollTo(0, y)", top + height)
+        else:
+            self.page.mouse.wheel(0, height)
+        PageReadiness.wait_until_ready(self.page, self.client, Settings.Scroll_Ready_Timeout, "scroll")
+        return "Scrolled down"
+
     def Click(self,params):
         """
         Click on a specific element identified by the node ID in the accessibility tree.
@@ -163,10 +364,12 @@ class AgentBrowser:
         node_id = params[0]
 
         current_node = self.accessibility_tree.getNodeByDomId(node_id)
+        if current_node is None:
+            return f"Exception: Node {node_id} is not in the current tree"
         self.Focus(node_id)
         focused_element = self.page.evaluate_handle('document.activeElement')
         focused_element.click();
-        return "Clicked " + current_node["name"]["value"]
+        return "Clicked " + current_node.name
     
     def Read(self,params):
         """
@@ -179,11 +382,29 @@ class AgentBrowser:
             str: The text content read from the element.
         """
         node_id = params[0]
+        if self.accessibility_tree.getNodeByDomId(node_id) is None:
+            return f"Exception: Node {node_id} is not in the current tree"
 
         self.Focus(node_id)
         focused_element = self.page.evaluate_handle('document.activeElement')
         return f"Text Read: {focused_element.text_content()}"
     
+    def Find(self,params):
+        """
+        Search every node in the accessibility tree, not just the current chunk, for the closest matches.
+
+        Args:
+            params (list): The words describing the node, split on commas.
+
+        Returns:
+            str: The best matching nodes, one per line, or an exception if nothing matched.
+        """
+        query = ",".join(params).strip().strip('"').strip("'")
+        nodes = self.accessibility_tree.find_nodes(query, Settings.Find_Top_K)
+        if not nodes:
+            return f"Exception: Find({query}) matched no nodes"
+        return f"Find results for {query}:\n" + "\n".join(self.accessibility_tree.node_line(node) for node in nodes)
+
     def Enter(self):
         """
         Presses the Enter key on the currently focused element.
@@ -205,7 +426,7 @@ class AgentBrowser:
             [x]Click(index) - clicks an element at index
             [x]Input(index,string) - inputs desired text into a combobox,textarea,input etc
             [Deprecated]Expand(index) - sets the node at index to expanded the children of the indexed node will now be visible
-            [Not implemented]Find(str) - uses a similarity search to look through ALL of the nodes in the body and returns a list of closest matching nodes(USE SORTING)
+            [X]Find(str) - uses a ranked search(BM25 over names and roles, trigrams for partial words) to look through ALL of the nodes in the body and returns a list of closest matching nodes
             [Deprecated]Read(index) - Reads the text attribute at the index and passes it into the prompt
             [X]Loop() - restarts the instruction loop
             [Not implemented]Wait()
@@ -221,14 +442,34 @@ class AgentBrowser:
         node_id = params[0]
 
         current_node = self.accessibility_tree.getNodeByDomId(node_id)
-
+        if current_node is None:
+            return f"Exception: Node {node_id} is not in the current tree"
 
         self.Focus(node_id)
         focused_element = self.page.evaluate_handle('document.activeElement')
 
         focused_element.type(params[1])
-        return f"Inputted the text {params[1]} to " + current_node["name"]["value"]
+        return f"Inputted the text {params[1]} to " + current_node.name
     
+    def CreateCommands(self,com_prompt,count=1,history=None):
+        """
+        Ask the command agent for the command of an instruction, through the model cascade with Settings.UseModelCascade.
+
+        Args:
+            com_prompt (str): The tree and instruction.
+            count (int): The max number of commands(default is 1).
+            history (list): The messages before the prompt in the tree delta conversation(default is None).
+
+        Returns:
+            str: The command plan.
+        """
+        if not Settings.UseModelCascade:
+            return LLMAgent.create_commands(com_prompt, self.website_name, self.timings, count, history=history)
+        return LLMAgent.command_cascade.run(
+            lambda model: LLMAgent.create_commands(com_prompt, self.website_name, self.timings, count, model, history),
+            lambda command_plan: command_trigger(command_plan, self.accessibility_tree),
+        )[0]
+
     #Find the desired command and extract the parameters for a function call
     def ExecuteCommand(self,command):
         """
@@ -240,30 +481,27 @@ class AgentBrowser:
         Returns:
             str: The result or message after executing the command.
         """
-        pattern = r"(?<=\().+?(?=\))"
-        match = re.search(pattern, command)
-        params = []
-        if match:
-            extracted_string = match.group()
-            params = extracted_string.split(",")
+        name, params = parse_command(command)
         try:
             # TODO: use case/match instead
-            if command.find('Input') != -1 and len(params) > 1:
+            if name == 'Input':
 
                 return self.input_command(params)
-            elif command.find('Navigate') != -1 and len(params) > 0:
+            elif name == 'Navigate':
                 return self.Navigate(params[0])
-            elif command.find('Click') != -1 and len(params) > 0:
+            elif name == 'Click':
                 return self.Click(params)
-            elif command.find('EndTask') != -1:
+            elif name == 'Find':
+                return self.Find(params)
+            elif name == 'EndTask':
                 return "Task End - summarize what you did"
-            elif command.find('Scroll') != -1:
+            elif name == 'Scroll':
                 return self.Scroll()
-            elif command.find('Expand') != -1 and len(params) > 0:
+            elif name == 'Expand':
                 return self.Expand(params)
-            elif command.find('Read') != -1 and len(params) > 0:
+            elif name == 'Read':
                 return self.Read(params)
-            elif command.find('Enter') != -1:
+            elif name == 'Enter':
                 return self.Enter()
             else:
                 return "Exception: Unknown Command"
@@ -271,81 +509,318 @@ class AgentBrowser:
             print(e)
             return f"Exception failed to execute: {command}"
 
-    #Main agent loop(Planner and command creator communication)
+    #Main agent loop(Prompts the user for tasks)
     def AgentLoop(self):
         """
-        Executes a loop for the AI agent to interact with a web page based on given instructions and commands.
+        Prompts for tasks and runs each one until the browser is closed.
         """
         while True:
-            starting_page = "https://example.com"
-            if Settings.Initial_Page is not None:
-                starting_page = Settings.Initial_Page
-            self.Navigate(starting_page)
             prompt = input("Prompt AI to complete task:\n")
-            self.original_prompt = prompt
-            if Settings.UsePlanner:
+            try:
+                result = self.run_task(prompt)
+            except Exception as e:
+                #A failed LLM call(after its retries) ends the task, not the agent
+                print(f"Task failed: {e!r}")
+                continue
+            if result["status"] == "completed":
+                input("Task completed! press any key to do another:")
+
+    #Planner and command creator communication for a single task
+    def run_task(self,prompt):
+        """
+        Executes a loop for the AI agent to interact with a web page based on given instructions and commands.
+
+        Args:
+            prompt (str): The task to complete.
+
+        Returns:
+            dict: The prompt, status("completed" or "failed"), attempts used, command trace and per stage timings.
+        """
+        starting_page = "https://example.com"
+        if Settings.Initial_Page is not None:
+            starting_page = Settings.Initial_Page
+        task_start = time.perf_counter()
+        Tracing.new_lane()
+        self.trace = []
+        self.timings = {}
+        with timed(self.timings, "navigate"):
+            self.Navigate(starting_page)
+        self.PageChanged()
+        self.original_prompt = prompt
+        self.last_result = "(Start of task): No command has been executed yet"
+        if Settings.UsePlanner:
+            with timed(self.timings, "planner"):
                 prompt = LLMAgent.create_planner(prompt)
-            attempts = 0
-            print(prompt)
-            while True:
-                self.reasoning_history.clear()
-                if attempts > Settings.Max_Attempts:
+        attempts = 0
+        print(prompt)
+        while True:
+            if attempts > Settings.Max_Attempts:
+                break
+            self.StartAttempt(prompt)
+            #for i in range(len(instruction_list)):
+            i = 0
+            while i < len(self.instruction_list): #Cheesy for loop so i can change iterator
+                instruction = self.instruction_list[i]
+                if len(instruction) < 3:
+                    i += 1
+                    continue
+                if instruction.lower().find("loop") == 0:
+                    i = 0
+                    continue
+                print("\nStep: " + str(i))
+                print(instruction)
+                step_start = time.perf_counter()
+                command_plan, request = self.PrepareStep(i, instruction)
+                if command_plan is None:
+                    with timed(self.timings, "commands"):
+                        command_plan = self.CreateCommands(*request)
+                    self.CommandsAnswered(command_plan)
+                #Only the first command of a batched response belongs to this instruction
+                command = next(iter(get_commands(command_plan)), "")
+                self.LogReasoning(i, instruction, command_plan)
+                if command.lower().find("exception") != -1: #Command maker decided it could not find the node
+                    print("Could not find NODE!")
+                    self.last_result = command.strip()
+                    self.RecordStep(attempts, i, instruction, command, step_start)
                     break
-                instruction_list = prompt[prompt.lower().find("instructions:") + 13:].split('\n')
-                #for i in range(len(instruction_list)):
-                i = 0
-                while i < len(instruction_list): #Cheesy for loop so i can change iterator
-                    instruction = instruction_list[i]
-                    if len(instruction) < 3:
-                        i += 1
-                        continue
-                    if instruction.lower().find("loop") == 0:
-                        i = 0
-                        continue
-                    print("\nStep: " + str(i))
-                    print(instruction)
-                    tree_view = self.OutputPage()
-                    if Settings.ShowTree:
-                        print(tree_view)
-                    com_prompt = tree_view + "\n\n Instruction:\n" + instruction
-                    command_plan = LLMAgent.create_commands(com_prompt, self.website_name)
-                    print("\nCommand Agent:\n" + command_plan)
-                    command = command_plan[command_plan.lower().find("command:") + 8:]
-
-                    self.reasoning_history.append(
-                        f"Reasoning Step {i}"
-                        + ':\n'
-                        + instruction
-                        + '\n'
-                        + command_plan
-                    )
-                    if len(self.reasoning_history) > 15: # Prevent the reasoning history from getting to big
-                        del self.reasoning_history[0]
-                    if command.lower().find("exception") != -1: #Command maker decided it could not find the node
-                        print("Could not find NODE!")
-                        self.last_result = command
-                        break
+                self.RememberCommand(instruction, command)
+                with timed(self.timings, "execute"):
                     self.last_result = self.ExecuteCommand(command)
-                    if self.last_result.lower().find("exception") == 0:
-                        print("Failed to execute command!")
-                        break
-                    self.last_instruction = instruction
-                    time.sleep(1)  # Wait a bit for page to fully load
-                    # Update the new accessibility tree
-                    self.accessibility_tree.update_tree(self.page)
-                    self.current_url = self.page.url
-                    rootAxNode = self.client.send('Accessibility.getRootAXNode')
-                    self.website_name = "Website: " + rootAxNode["node"]["name"]["value"] + '\n'
+                outcome = self.StepOutcome(instruction, command)
+                if outcome == "next":
+                    self.UpdateTree()
+                self.RecordStep(attempts, i, instruction, command, step_start)
+                if outcome == "failed":
+                    break
+                if outcome == "next":
                     i += 1
-                if Settings.UseUpdater and self.last_result.lower().find("exception") == 0:
-                    #Add code to update planner with screenshot of page
-                    self.page.screenshot(path='screenshot.png')
-                    page_summary = VisionAgent.PromptVision("screenshot.png",self.website_name)
-                    print(f"Summary of page: {page_summary}")
-                    prompt = LLMAgent.update_plan(prompt, self.original_prompt, self.website_name, self.reasoning_history, page_summary)
-                    print("Update Plan Agent:\n" + prompt)
-                    attempts += 1
-                    continue
+            if self.last_result.lower().find("exception") == 0:
+                if not Settings.UseUpdater:
+                    break
+                prompt = self.UpdatePlan(prompt)
+                attempts += 1
+                continue
 
-                input("Task completed! press any key to do another:")
-                break
+            self.StoreCommands()
+            return self.TaskResult("completed", attempts, task_start)
+        return self.TaskResult("failed", attempts, task_start)
+
+    #The per step logic below does no page or LLM I/O, so the async driver shares it
+
+    def StartAttempt(self,prompt):
+        """
+        Reset the state of an attempt before the instructions of a plan are run.
+
+        Args:
+            prompt (str): The plan.
+        """
+        self.reasoning_history.clear()
+        if self.tree_conversation is not None:
+            self.tree_conversation.reset()
+        self.instruction_list = get_instructions(prompt)
+        self.memo_entries = [] #Commands of this attempt, remembered once the task completes
+        self.find_results = None #Result of a Find command, shown when the same instruction is resolved again
+        self.finds = 0
+        self.batch = [] #Commands the last response made for the next instructions
+        self.batch_steps = [] #The next instructions the last command agent request was given
+
+    def PrepareStep(self,i,instruction):
+        """
+        Resolve the command of an instruction from the last batched response or the command memo, or build the command agent request.
+
+        Args:
+            i (int): The step index.
+            instruction (str): The instruction of the step.
+
+        Returns:
+            tuple: The command plan and None when it was resolved, otherwise None and the arguments of CreateCommands.
+        """
+        #The deltas compare the nodes of the output, a packed output changes with every instruction
+        tree_view = self.OutputPage(instruction=None if self.tree_conversation is not None else instruction)
+        if Settings.ShowTree:
+            print(tree_view)
+        command_plan = None
+        if Settings.UseCommandBatching:
+            command_plan = next_batched_command(self.batch, i, self.page.url, self.accessibility_tree)
+        if command_plan is None and command_memo is not None:
+            command_plan = command_memo.lookup(self.website_name, instruction, self.accessibility_tree)
+        if command_plan is not None:
+            return command_plan, None
+        step_prompt = "\n\n Instruction:\n" + instruction
+        if self.find_results is not None:
+            step_prompt = "\n\n" + self.find_results + step_prompt
+        self.batch_steps = next_steps(self.instruction_list, i, Settings.Max_Batch_Commands - 1) if Settings.UseCommandBatching else []
+        if self.batch_steps:
+            step_prompt += "\n\n Next instructions:\n" + "\n".join(self.instruction_list[step] for step in self.batch_steps)
+        history = None
+        com_prompt = tree_view + step_prompt
+        if self.tree_conversation is not None:
+            history, com_prompt = self.tree_conversation.prompt(self.page.url, self.accessibility_tree, tree_view, step_prompt)
+        return None, (com_prompt, len(self.batch_steps) + 1, history)
+
+    def CommandsAnswered(self,command_plan):
+        """
+        Keep the commands a command agent response made for the next instructions.
+
+        Args:
+            command_plan (str): The response of the command agent.
+        """
+        self.batch = batch_commands(command_plan, self.batch_steps, self.page.url)
+
+    def RememberCommand(self,instruction,command):
+        """
+        Capture the target of a command for the command memo before it is executed.
+        """
+        if command_memo is not None:
+            self.memo_entries.append((self.website_name, instruction, command_memo.prepare(*parse_command(command), self.accessibility_tree)))
+
+    def StoreCommands(self):
+        """
+        Remember the commands of a completed attempt in the command memo.
+        """
+        if command_memo is not None:
+            for memo_entry in self.memo_entries:
+                command_memo.store(*memo_entry)
+
+    def StepOutcome(self,instruction,command):
+        """
+        Decide how the task goes on after a command was executed, from its result in self.last_result.
+
+        Args:
+            instruction (str): The instruction of the step.
+            command (str): The executed command.
+
+        Returns:
+            str: "next" to go on to the next instruction, "retry" to resolve the same instruction again
+            with the Find results in view or "failed" to end the attempt.
+        """
+        if self.last_result.lower().find("exception") == 0:
+            #Not asked again from a bigger model, the command may have acted on the page before it failed
+            print("Failed to execute command!")
+            return "failed"
+        if parse_command(command)[0] == "Find":
+            #Resolve the same instruction again with the matches in view, the page did not change
+            self.find_results = self.last_result
+            self.finds += 1
+            if self.finds > Settings.Max_Finds_Per_Step:
+                self.last_result = "Exception: Could not find the node after searching"
+                return "failed"
+            return "retry"
+        self.find_results = None
+        self.finds = 0
+        self.last_instruction = instruction
+        return "next"
+
+    def LogReasoning(self,i,instruction,command_plan):
+        """
+        Print the command agent output and add it to the reasoning history.
+
+        Args:
+            i (int): The step index.
+            instruction (str): The instruction of the step.
+            command_plan (str): The output of the command agent.
+        """
+        print("\nCommand Agent:\n" + command_plan)
+        self.reasoning_history.append(
+            f"Reasoning Step {i}"
+            + ':\n'
+            + instruction
+            + '\n'
+            + command_plan
+        )
+        if len(self.reasoning_history) > 15: # Prevent the reasoning history from getting to big
+            del self.reasoning_history[0]
+
+    def UpdateTree(self):
+        """
+        Wait for the page to be ready after a command, then update the accessibility tree and website name.
+        """
+        with timed(self.timings, "readiness"):
+            PageReadiness.wait_until_ready(self.page, self.client, Settings.Ready_Timeout, "command")
+        # Update the new accessibility tree
+        with timed(self.timings, "tree"):
+            self.accessibility_tree.update_tree(self.page)
+            self.LoadLayout()
+        self.current_url = self.page.url
+        self.website_name = "Website: " + self.accessibility_tree.get_root_name() + '\n'
+        self.PageChanged()
+
+    def UpdatePlan(self,prompt):
+        """
+        Summarize the current page and ask the updater for a new plan after an attempt failed.
+
+        Args:
+            prompt (str): The plan that failed.
+
+        Returns:
+            str: The updated plan.
+        """
+        #Add code to update planner with screenshot of page
+        with timed(self.timings, "vision"):
+            image, image_hash = ScreenCapture.capture(self.client)
+            if self.screenshot_path is not None:
+                with open(self.screenshot_path, "wb") as screenshot:
+                    screenshot.write(image)
+            page_summary = None
+            if self.speculative_vision is not None:
+                page_summary = self.speculative_vision.summary(self.website_name, image_hash)
+            if page_summary is None:
+                page_summary = VisionAgent.PromptVision(image,self.website_name,image_hash)
+        print(f"Summary of page: {page_summary}")
+        with timed(self.timings, "updater"):
+            prompt = LLMAgent.update_plan(prompt, self.original_prompt, self.website_name, self.reasoning_history, page_summary)
+        print("Update Plan Agent:\n" + prompt)
+        return prompt
+
+    def PageChanged(self):
+        """
+        Start summarizing the current page in the background when Settings.UseSpeculativeVision is on.
+        """
+        if self.speculative_vision is not None:
+            with timed(self.timings, "speculative_capture"):
+                self.speculative_vision.page_changed(self.client, self.website_name)
+
+    def RecordStep(self,attempt,i,instruction,command,step_start):
+        """
+        Add an executed(or failed) command to the trace of the current task.
+
+        Args:
+            attempt (int): The attempt the step belongs to.
+            i (int): The step index.
+            instruction (str): The instruction of the step.
+            command (str): The command that was executed.
+            step_start (float): perf_counter value when the step started.
+        """
+        self.trace.append({
+            "attempt": attempt,
+            "step": i,
+            "instruction": instruction,
+            "command": command.strip(),
+            "result": self.last_result,
+            "seconds": round(time.perf_counter() - step_start, 3),
+        })
+        Tracing.record("step", step_start, attempt=attempt, step=i, instruction=instruction, command=command.strip(), result=self.last_result)
+
+    def TaskResult(self,status,attempts,task_start):
+        """
+        Build the result record of the current task.
+
+        With Settings.UseModelCascade the per tier counters of the cascades are logged and added to it,
+        they are totals over every task run in this process so far.
+
+        Returns:
+            dict: The prompt, status, attempts used, command trace and seconds spent per stage.
+        """
+        Tracing.record("task", task_start, prompt=self.original_prompt, status=status, attempts=attempts)
+        result = {
+            "prompt": self.original_prompt,
+            "status": status,
+            "attempts": attempts,
+            "trace": self.trace,
+            "timings": {stage: round(seconds, 3) for stage, seconds in self.timings.items()},
+            "seconds": round(time.perf_counter() - task_start, 3),
+        }
+        if Settings.UseModelCascade:
+            result["cascade"] = LLMAgent.cascade_stats()
+            print("Model cascade: " + json.dumps(result["cascade"]))
+        return result
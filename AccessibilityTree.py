@@ -1,162 +1,360 @@
-from playwright._impl._cdp_session import CDPSession
+from typing import TYPE_CHECKING
+import sys
 import Settings
+import NodeSearch
+import PageLayout
+import Tracing
+from itertools import islice
+from collections import defaultdict, deque
+
+if TYPE_CHECKING:
+    #Only needed for the annotation, so the tree loads without Playwright(e.g. in the benchmarks)
+    from playwright._impl._cdp_session import CDPSession
+
+
+#CDP keys of the dict style access to an AXNode and the attributes they map to
+CDP_KEYS = {
+    "nodeId": "node_id",
+    "parentId": "parent_id",
+    "childIds": "child_ids",
+    "backendDOMNodeId": "backend_id",
+    "role": "role",
+    "name": "name",
+    "ignored": "ignored",
+    "expanded": "expanded",
+    "children": "children",
+}
+
+
+class AXNode:
+    """
+    A node of the accessibility tree decoded once from its getFullAXTree dict.
+
+    Only the fields the tree uses are kept, roles are interned and the focusable property is
+    read at load instead of scanning the properties on every check. Missing fields are None.
+    node["name"]["value"], "name" in node and node.get(...) still work like on the CDP dict.
+    """
+    __slots__ = ("node_id", "parent_id", "child_ids", "backend_id", "role", "name", "ignored", "focusable", "expanded", "children")
+
+    def __init__(self,node):
+        self.node_id = node["nodeId"]
+        self.parent_id = node.get("parentId")
+        self.child_ids = node.get("childIds", ())
+        self.backend_id = node.get("backendDOMNodeId")
+        self.role = sys.intern(node["role"]["value"]) if "role" in node else None
+        self.name = node["name"]["value"] if "name" in node else None
+        self.ignored = node.get("ignored", False)
+        self.focusable = False
+        for prop in node.get("properties", ()):
+            if prop["name"] == "focusable":
+                self.focusable = prop["value"]["value"]
+                break
+        self.expanded = False
+        self.children = None
+
+    #Takes the CDP fields of a fresher copy of the node, keeping its place in the tree
+    def replace(self,node):
+        for field in ("node_id", "parent_id", "child_ids", "backend_id", "role", "name", "ignored", "focusable"):
+            setattr(self, field, getattr(node, field))
+
+    def copy(self):
+        node = AXNode.__new__(AXNode)
+        for field in AXNode.__slots__:
+            setattr(node, field, getattr(self, field))
+        return node
+
+    def __getitem__(self,key):
+        value = getattr(self, CDP_KEYS[key])
+        if value is None:
+            raise KeyError(key)
+        return {"value": value} if key in ("role", "name") else value
+
+    def __setitem__(self,key,value):
+        setattr(self, CDP_KEYS[key], value)
+
+    def __contains__(self,key):
+        return key in CDP_KEYS and getattr(self, CDP_KEYS[key]) is not None
+
+    def get(self,key,default=None):
+        return self[key] if key in self else default
 
 
 class AccessibilityTree:
-    full_tree = []
-    client = None
-    chunk_index = 0
     chunk_length = 200
 
-    def __init__(self,c:CDPSession,snapshot):
+    #all_nodes can be passed in when the getFullAXTree response was already fetched(e.g. by the async driver)
+    def __init__(self,c:"CDPSession",snapshot,all_nodes=None):
+        #Every piece of state is per instance so several sessions can hold their own trees
         self.client = c
-        self.load_tree(snapshot)
+        self.full_tree = []
         self.chunk_index = 0
+        self.node_index = {}
+        self.incremental = False
+        self.needs_reload = False
+        self.loaded_url = None
+        self.line_total = None
+        self.line_cache = {}
+        self.output_cache = {}
+        self.ax_nodes = {}
+        self.root_node = None
+        self.role_name_index = None
+        self.search_index = None
+        #Layout boxes by backendDOMNodeId and the (top, height, page height) of the viewport, set by set_layout
+        self.node_boxes = {}
+        self.viewport = None
+        self.load_tree(snapshot,all_nodes)
 
-    #DO NOT USE get_node_children if the node has a children element instead use node["children"]
+    #DO NOT USE get_node_children if the node has a children element instead use node.children
+    #Children are resolved from the childIds of the fetched tree so no CDP call is made
     def get_node_children(self, node):
-        nodeId = node["nodeId"]
-        all_children = self.client.send('Accessibility.getChildAXNodes', {
-            'id': nodeId,
-        })['nodes']
+        all_children = [self.ax_nodes[child_id] for child_id in node.child_ids if child_id in self.ax_nodes]
 
         return [
             child
             for child in all_children
-            if "backendDOMNodeId" in child
-            and "backendDOMNodeId" in node
-            and child["backendDOMNodeId"] != node["backendDOMNodeId"]
+            if child.backend_id is not None
+            and node.backend_id is not None
+            and child.backend_id != node.backend_id
         ]
 
-    def getNodeByDomId(self,id,children=None):
-        #Set default value to full tree
-        if children is None:
-            children = self.full_tree
-        #recursively iterate through the tree until you find the node by its ID
-        for child in children:
-            if child["backendDOMNodeId"] in [id, int(id)]:
-                return child
-            #Search the children if they exist
-            if "children" in child:
-                output = self.getNodeByDomId(id,child["children"])
-                if output is not None:
-                    return output
-        return None
+    #Fetches every AX node with a single CDP call and indexes them by nodeId for local parent/child lookups
+    def fetch_nodes(self):
+        return self.set_nodes(self.client.send("Accessibility.getFullAXTree")["nodes"])
+
+    #Decodes a getFullAXTree node list into AXNodes and indexes them by nodeId, the CDP dicts are not kept
+    def set_nodes(self,all_nodes):
+        all_nodes = [AXNode(node) for node in all_nodes]
+        self.ax_nodes = {node.node_id: node for node in all_nodes}
+        self.root_node = next((node for node in all_nodes if node.parent_id is None), None)
+        return all_nodes
+
+    #Name of the root web area which is the page title
+    def get_root_name(self):
+        if self.root_node is None or self.root_node.name is None:
+            return ""
+        return self.root_node.name
+
+    #Looks up a node by its backendDOMNodeId using the index built in load_tree
+    def getNodeByDomId(self,id):
+        try:
+            return self.node_index.get(int(id))
+        except (TypeError, ValueError):
+            return None
 
+    #Looks up a shown node by its role and name, the index is rebuilt lazily after the tree changes
+    def getNodeByRoleName(self,role,name):
+        if self.role_name_index is None:
+            self.role_name_index = {}
+            for node in self.node_index.values():
+                if node.role is not None and node.name is not None:
+                    self.role_name_index.setdefault((node.role, node.name), node)
+        return self.role_name_index.get((role, name))
+
+    #Ranked search over the names and roles of every node in the tree, not just the current chunk
+    #The index is built from the loaded tree on first use and dropped whenever the tree changes
+    def find_nodes(self,query,k=10):
+        return [node for score, node in self.rank_nodes(query, k)]
+
+    #(score, node) pairs of the k nodes most relevant to a query, best first
+    def rank_nodes(self,query,k=10):
+        if self.search_index is None:
+            self.search_index = NodeSearch.NodeSearchIndex(self.node_index.values())
+        return self.search_index.search(query, k)
+
+    #Adds the nodes and their expanded children to the backendDOMNodeId index
+    def index_nodes(self,nodes):
+        for node in nodes:
+            if node.backend_id is not None:
+                self.node_index[node.backend_id] = node
+            if node.children is not None:
+                self.index_nodes(node.children)
 
     #Expand the node and get its children
     def expand_node(self,id):
         node = self.getNodeByDomId(id)
         if node is not None:
-            node["expanded"] = True
-            node["children"] = self.get_node_children(node)
+            node.expanded = True
+            node.children = self.get_node_children(node)
+            self.index_nodes(node.children)
+            self.tree_changed([])
         return "Expanded Node"
 
-    #Checks if a node is focusable
+    #Checks if a node is focusable, decoded once when the node was loaded
     def is_focusable(self,node):
-        is_focusable = False
-        if "properties" in node:
-            for prop in node["properties"]:
-                if prop["name"] == "focusable":
-                    is_focusable = prop["value"]["value"]
-                    break
-        return is_focusable
+        return node.focusable
+
+    #Whether or not a node gets a line in the output
+    def is_shown(self,node):
+        return not node.ignored and node.role is not None and (node.focusable or not Settings.OnlyFocusable)
+
+    #The serialized line of a single node, memoized until the tree changes
+    def node_line(self,node):
+        key = node.node_id
+        if key not in self.line_cache:
+            node_line = ""
+            if node.backend_id is not None:
+                node_line += str(node.backend_id) + " "
+            node_line += node.role + " "
+            if node.name is not None:
+                node_line += node.name + " "
+            self.line_cache[key] = node_line[:Settings.Max_Node_Size].replace("\n"," ")
+        return self.line_cache[key]
+
+    #Lazily walks the shown nodes in output order, yielding each node with its indentation level
+    def iter_shown(self,children,inline=0):
+        for child in children:
+            if self.is_shown(child):
+                yield child, inline
+            if child.expanded and child.children is not None:
+                yield from self.iter_shown(child.children,inline+1)
+
+    #Lazily yields the output lines of the tree
+    def iter_lines(self,children,inline=0):
+        for node, level in self.iter_shown(children,inline):
+            yield ("    " * level) + self.node_line(node)
 
     #Outputs the entire tree in a chunk
     def to_string(self,children,inline=0):
-        out_string = ""
-        for child in children:
-            out_string += ("    " * inline)
-            is_focusable = self.is_focusable(child)
-            if not child["ignored"] and "role" in child and (is_focusable or not Settings.OnlyFocusable):
-                node_line = ""
-                if "backendDOMNodeId" in child:
-                   #out_string += "id: " + str(child["backendDOMNodeId"]) + " "
-                    node_line += str(child["backendDOMNodeId"]) + " "
-                #out_string += "role: " + child["role"]["value"] + " "
-                node_line += child["role"]["value"] + " "
-                if "name" in child:
-                    #out_string += "name: " + child["name"]["value"] + " "
-                    node_line += child["name"]["value"] + " "
-            
-                #out_string += "focusable: " + str(is_focusable)
-                out_string += node_line[:Settings.Max_Node_Size].replace("\n"," ")
-                out_string += "\n"
-            if "expanded" in child and child["expanded"] and "children" in child:
-                out_string += self.to_string(child["children"],inline+1)
-        return out_string
-    
+        return "".join(line + "\n" for line in self.iter_lines(children,inline))
+
+    #Number of lines in the output of the whole tree, memoized until the tree changes
+    def count_lines(self):
+        if self.line_total is None:
+            self.line_total = sum(1 for _ in self.iter_shown(self.full_tree))
+        return self.line_total
+
+    #Drops memoized output, either for the given nodes or for the whole tree
+    def tree_changed(self,nodes=None):
+        self.line_total = None
+        self.output_cache = {}
+        self.role_name_index = None
+        self.search_index = None
+        if nodes is None:
+            self.line_cache = {}
+            return
+        for node in nodes:
+            self.line_cache.pop(node.node_id, None)
+
     #Update the tree based on accessibility snapshot
     def update_tree(self,page):
-        snapshot = page.accessibility.snapshot()
+        #In incremental mode only the nodes reported by change events are patched unless the page navigated
+        if self.incremental and Settings.UseFullTree and page.url == self.loaded_url and self.apply_patches():
+            return
+        snapshot = None if Settings.UseFullTree else page.accessibility.snapshot()
         self.load_tree(snapshot)
+        if self.incremental:
+            self.loaded_url = page.url
+            self.mirror_dom()
+
+    #Stores the layout boxes and scroll position the tree is paged by with Settings.UseViewportPaging
+    def set_layout(self,layout_snapshot,metrics):
+        self.node_boxes = PageLayout.node_boxes(layout_snapshot)
+        self.viewport = PageLayout.viewport(metrics)
 
-    #Outputs tree
-    def get_output(self):
-        full_string = self.to_string(self.full_tree)
-        output_string = ""
-        output_lines = full_string.split('\n')
+    #Whether the viewport reaches the bottom of the page
+    def at_page_end(self):
+        top, height, page_height = self.viewport
+        return top + height >= page_height
+
+    #Outputs the current chunk of the tree, memoized with the line count until the tree changes
+    #Only the lines in the chunk are serialized, the same walk counts the rest
+    def get_output(self,max_chars=None):
+        if Settings.UseViewportPaging and self.viewport is not None:
+            return self.get_viewport_output(max_chars)
         index_start = self.chunk_index*self.chunk_length
-        if index_start > len(output_lines):
+        if index_start > 0 and self.line_total is not None and index_start >= self.line_total:
             index_start = 0
             self.chunk_index = 0
             print("End of page reached")
-        lastLine = 0
-        for i in range(index_start,min([len(output_lines)-index_start,self.chunk_length+index_start])):
-            output_string += output_lines[i] + '\n'
-            lastLine = i
-
-        output_string += "\n +" + str(len(output_lines)-lastLine) + " ...Nodes remaining"
+        key = (index_start, self.chunk_length, max_chars)
+        if key in self.output_cache:
+            return self.output_cache[key]
+        output_lines = []
+        output_length = 0
+        total = 0
+        for total, (node, level) in enumerate(self.iter_shown(self.full_tree), 1):
+            if total <= index_start or total > index_start + self.chunk_length:
+                continue
+            if max_chars is not None and output_length > max_chars:
+                continue
+            line = ("    " * level) + self.node_line(node) + '\n'
+            output_lines.append(line)
+            output_length += len(line)
+        self.line_total = total
+        if index_start > 0 and index_start >= total:
+            return self.get_output(max_chars)
 
+        output_lines.append("\n +" + str(total - index_start - len(output_lines)) + " ...Nodes remaining")
+        output_string = "".join(output_lines)
+        if max_chars is not None:
+            output_string = output_string[:max_chars]
+        self.output_cache[key] = output_string
         return output_string
     
+    #Outputs the shown nodes that are on screen, a node without a layout box is placed at the top of the node before it
+    def get_viewport_output(self,max_chars=None):
+        top, height, page_height = self.viewport
+        output_lines = []
+        output_length = 0
+        below = 0
+        box = (0, 0)
+        for node, level in self.iter_shown(self.full_tree):
+            box = self.node_boxes.get(node.backend_id) or (box[0], box[0])
+            if box[0] >= top + height:
+                below += 1
+                continue
+            if not PageLayout.in_view(box, top, height) or (max_chars is not None and output_length > max_chars):
+                continue
+            line = ("    " * level) + self.node_line(node) + '\n'
+            output_lines.append(line)
+            output_length += len(line)
+
+        output_lines.append("\n +" + str(below) + " ...Nodes below the screen")
+        output_string = "".join(output_lines)
+        if max_chars is not None:
+            output_string = output_string[:max_chars]
+        return output_string
+
+    #The shown nodes of the current chunk, or of the screen with viewport paging, in output order
+    def chunk_nodes(self):
+        if Settings.UseViewportPaging and self.viewport is not None:
+            top, height, page_height = self.viewport
+            nodes = []
+            box = (0, 0)
+            for node, level in self.iter_shown(self.full_tree):
+                box = self.node_boxes.get(node.backend_id) or (box[0], box[0])
+                if PageLayout.in_view(box, top, height):
+                    nodes.append(node)
+            return nodes
+        index_start = self.chunk_index*self.chunk_length
+        return [node for node, level in islice(self.iter_shown(self.full_tree), index_start, index_start + self.chunk_length)]
+
     #Recursively iterate through the children of a node and its descendents
     def get_all_children(self,node):
         children = self.get_node_children(node)
-        if "expanded" not in node:
-            node["expanded"] = False
         for child in children:
 
             childs_children = self.get_all_children(child)
-            child["children"] = childs_children
+            child.children = childs_children
 
         return children
 
-    #Converts a snapshot into a list of nodes
-    def getStartPage(self, accessibility_snapshot):
-        start_page = []
-        rootAxNode = self.client.send('Accessibility.getRootAXNode')
-        all_nodes = self.client.send("Accessibility.getFullAXTree")["nodes"]
-
-        for tree_node in accessibility_snapshot["children"]:
-            #  new_node = client.send("Accessibility.queryAXTree",{'nodeId': str(rootNodeID), 'accessibleName': node["name"], 'role': node["role"]})
-
-            # Filter the nodes based on name and role
-            '''matching_nodes = [node for node in full_tree.get("nodes", [])
-                              if node.get("name", {}).get("value") == tree_node["name"]
-                              and node.get("role", {}).get("value") == tree_node["role"]]
-            '''
-            #matching_nodes = []
-            matching_node = None
-            for i in range(len(all_nodes)):
-                node = all_nodes[i]
-                node_role = node["role"]["value"]
-                if "name" in node:
-                    node_name = node["name"]["value"]
-                    #if node_role == tree_node["role"] and node_name == tree_node["name"]:
-                    if node_name == tree_node["name"] and "backendDOMNodeId" in node:
-                        copy_of_node = node.copy()
-                        del all_nodes[i]
-                        matching_node = copy_of_node
-                        break
-
-
-            if matching_node is not None:
-                new_node = matching_node
-                start_page.append(new_node)
+    #Converts a snapshot into a list of nodes, all_nodes are AXNodes as returned by set_nodes
+    def getStartPage(self, accessibility_snapshot, all_nodes=None):
+        if all_nodes is None:
+            all_nodes = self.fetch_nodes()
 
+        #Named nodes grouped by name in document order, each snapshot node takes the first unused match
+        nodes_by_name = defaultdict(deque)
+        for node in all_nodes:
+            if node.name is not None and node.backend_id is not None:
+                nodes_by_name[node.name].append(node)
 
-        #print(len(all_nodes["nodes"]))
+        start_page = []
+        for tree_node in (accessibility_snapshot or {}).get("children", []):
+            matching_nodes = nodes_by_name.get(tree_node["name"])
+            if matching_nodes:
+                start_page.append(matching_nodes.popleft().copy())
 
         return start_page
 
@@ -165,33 +363,247 @@ class AccessibilityTree:
         all_children = self.get_node_children(node)
         focusable_children = []
         for child in all_children:
-            if is_focusable := self.is_focusable(child):
+            if child.focusable:
                 focusable_children.append(child)
         return focusable_children
 
+    #Whether or not a fetched node is shown in the tree
+    def accept_node(self,node):
+        return node.focusable or not Settings.OnlyFocusable
+
     #Loads the tree based on snapshot
-    def load_tree(self,snapshot):
+    def load_tree(self,snapshot,all_nodes=None):
         start_page = []
 
+        all_nodes = self.fetch_nodes() if all_nodes is None else self.set_nodes(all_nodes)
         if Settings.UseFullTree:
-            start_page = self.client.send("Accessibility.getFullAXTree")["nodes"]
+            start_page = all_nodes
         else:
-            start_page = self.getStartPage(snapshot)
+            start_page = self.getStartPage(snapshot, all_nodes)
 
         if self.full_tree is not None:
             self.full_tree.clear()
+        self.node_index = {}
+        self.tree_changed()
         for child in start_page:
 
 
             #child["children"] = self.get_all_children(child)
-            is_focusable = self.is_focusable(child)
-            if not is_focusable and Settings.OnlyFocusable:
+            if not self.accept_node(child):
                 continue
-            child["expanded"] = True
-            if not is_focusable and "name" in child:
+            child.expanded = True
+            if not child.focusable and child.name is not None:
                 focusable_children = self.get_focusable_children(child)
                 for focus_child in focusable_children:
-                    if "name" in focus_child and focus_child["name"]["value"] == child["name"]["value"]:
+                    if focus_child.name == child.name:
                         child = focus_child
                         break
             self.full_tree.append(child)
+        self.index_nodes(self.full_tree)
+        Tracing.annotate(nodes=len(self.ax_nodes), tree_nodes=len(self.node_index))
+
+
+    #Subscribes to CDP change events so update_tree can patch the tree instead of refetching it
+    def enable_incremental(self,url):
+        self.incremental = True
+        self.loaded_url = url
+        self.client.on("Accessibility.nodesUpdated", self.on_nodes_updated)
+        self.client.on("Accessibility.loadComplete", self.on_document_changed)
+        self.client.on("DOM.documentUpdated", self.on_document_changed)
+        self.client.on("DOM.setChildNodes", self.on_set_child_nodes)
+        self.client.on("DOM.childNodeInserted", self.on_child_inserted)
+        self.client.on("DOM.childNodeRemoved", self.on_child_removed)
+        self.client.on("DOM.attributeModified", self.on_node_modified)
+        self.client.on("DOM.characterDataModified", self.on_node_modified)
+        self.client.send("DOM.enable")
+        self.mirror_dom()
+
+    #Mirrors the DOM structure so mutation events (which only carry DOM nodeIds) can be mapped to backendDOMNodeIds
+    def mirror_dom(self):
+        self.dom_backend_ids = {}
+        self.dom_parents = {}
+        self.dom_children = {}
+        self.clear_patches()
+        root = self.client.send("DOM.getDocument", {"depth": -1, "pierce": True})["root"]
+        self.track_dom_node(root)
+
+    def clear_patches(self):
+        self.needs_reload = False
+        self.updated_nodes = {}
+        self.changed_nodes = set()
+        self.inserted_nodes = []
+        self.removed_nodes = set()
+        self.shown_nodes = []
+
+    #Records a DOM node and its known descendants in the mirror
+    def track_dom_node(self,node,parent_id=None):
+        stack = [(node, parent_id)]
+        while stack:
+            dom_node, parent = stack.pop()
+            node_id = dom_node["nodeId"]
+            children = dom_node.get("children", []) + dom_node.get("shadowRoots", [])
+            if "contentDocument" in dom_node:
+                children.append(dom_node["contentDocument"])
+            self.dom_backend_ids[node_id] = dom_node["backendNodeId"]
+            self.dom_parents[node_id] = parent
+            if "children" in dom_node or node_id not in self.dom_children:
+                self.dom_children[node_id] = [child["nodeId"] for child in children]
+            stack.extend((child, node_id) for child in children)
+
+    #Removes a DOM node and its descendants from the mirror and returns their backendDOMNodeIds
+    def untrack_dom_node(self,node_id):
+        removed = set()
+        stack = [node_id]
+        while stack:
+            current = stack.pop()
+            if current in self.dom_backend_ids:
+                removed.add(self.dom_backend_ids.pop(current))
+            self.dom_parents.pop(current, None)
+            stack.extend(self.dom_children.pop(current, []))
+        return removed
+
+    def on_document_changed(self,params):
+        self.needs_reload = True
+
+    def on_nodes_updated(self,params):
+        for node in params.get("nodes", []):
+            if "backendDOMNodeId" in node:
+                self.updated_nodes[node["backendDOMNodeId"]] = node
+
+    def on_set_child_nodes(self,params):
+        parent_id = params["parentId"]
+        self.dom_children[parent_id] = [child["nodeId"] for child in params["nodes"]]
+        for child in params["nodes"]:
+            self.track_dom_node(child, parent_id)
+
+    def on_child_inserted(self,params):
+        parent_id = params["parentNodeId"]
+        node = params["node"]
+        siblings = self.dom_children.setdefault(parent_id, [])
+        previous_id = params.get("previousNodeId", 0)
+        position = siblings.index(previous_id) + 1 if previous_id in siblings else 0
+        siblings.insert(position, node["nodeId"])
+        self.track_dom_node(node, parent_id)
+        self.inserted_nodes.append(node["nodeId"])
+
+    def on_child_removed(self,params):
+        node_id = params["nodeId"]
+        siblings = self.dom_children.get(params["parentNodeId"], [])
+        if node_id in siblings:
+            siblings.remove(node_id)
+        removed = self.untrack_dom_node(node_id)
+        self.removed_nodes |= removed
+        self.changed_nodes -= removed
+
+    def on_node_modified(self,params):
+        backend_id = self.dom_backend_ids.get(params["nodeId"])
+        if backend_id is not None:
+            self.changed_nodes.add(backend_id)
+
+    #Replaces the contents of an existing node with a fresh copy from a CDP event, or drops it if it is no longer shown
+    def patch_node(self,new_node):
+        new_node = AXNode(new_node)
+        node = self.node_index.get(new_node.backend_id)
+        if node is None:
+            #A node that was not shown before(e.g. it just became focusable) is added like an inserted one
+            if self.accept_node(new_node):
+                self.shown_nodes.append(new_node)
+            return
+        if not self.accept_node(new_node):
+            self.removed_nodes.add(new_node.backend_id)
+            return
+        self.tree_changed([node, new_node])
+        self.ax_nodes.pop(node.node_id, None)
+        node.replace(new_node)
+        self.ax_nodes[node.node_id] = node
+
+    #Finds the tree node that inserted nodes should follow, the last shown node before them in document order
+    def find_insert_anchor(self,node_id):
+        positions = {id(node): i for i, node in enumerate(self.full_tree)}
+        current = node_id
+        while current is not None:
+            parent = self.dom_parents.get(current)
+            siblings = self.dom_children.get(parent, [])
+            previous = siblings[:siblings.index(current)] if current in siblings else []
+            for sibling in reversed(previous):
+                best = -1
+                stack = [sibling]
+                while stack:
+                    dom_id = stack.pop()
+                    node = self.node_index.get(self.dom_backend_ids.get(dom_id))
+                    if node is not None and id(node) in positions:
+                        best = max(best, positions[id(node)])
+                    stack.extend(self.dom_children.get(dom_id, []))
+                if best != -1:
+                    return best
+            node = self.node_index.get(self.dom_backend_ids.get(parent))
+            if node is not None and id(node) in positions:
+                return positions[id(node)]
+            current = parent
+        return -1
+
+    #Applies the queued change events to full_tree, returns False when a full reload is needed instead
+    def apply_patches(self):
+        #Round trip so change events queued before this point are dispatched
+        self.client.send("Runtime.evaluate", {"expression": "0"})
+        pending = len(self.updated_nodes) + len(self.changed_nodes) + len(self.inserted_nodes) + len(self.removed_nodes)
+        if self.needs_reload or pending > Settings.Incremental_Patch_Limit:
+            return False
+
+        for node in self.updated_nodes.values():
+            self.patch_node(node)
+        for backend_id in self.changed_nodes:
+            try:
+                nodes = self.client.send("Accessibility.getPartialAXTree", {"backendNodeId": backend_id, "fetchRelatives": True})["nodes"]
+            except Exception:
+                continue
+            for node in nodes:
+                if "backendDOMNodeId" in node:
+                    self.patch_node(node)
+
+        if self.removed_nodes:
+            self.full_tree[:] = [node for node in self.full_tree if node.backend_id not in self.removed_nodes]
+            for backend_id in self.removed_nodes:
+                self.node_index.pop(backend_id, None)
+
+        for node_id in self.inserted_nodes:
+            backend_id = self.dom_backend_ids.get(node_id)
+            if backend_id is None:
+                continue
+            try:
+                nodes = [AXNode(node) for node in self.client.send("Accessibility.queryAXTree", {"backendNodeId": backend_id})["nodes"]]
+            except Exception:
+                continue
+            new_nodes = [
+                node
+                for node in nodes
+                if node.backend_id is not None
+                and node.backend_id not in self.node_index
+                and self.accept_node(node)
+            ]
+            for node in nodes:
+                self.ax_nodes.setdefault(node.node_id, node)
+            for node in new_nodes:
+                node.expanded = True
+            anchor = self.find_insert_anchor(node_id)
+            self.full_tree[anchor + 1:anchor + 1] = new_nodes
+            self.index_nodes(new_nodes)
+
+        if self.shown_nodes:
+            dom_ids = {backend_id: node_id for node_id, backend_id in self.dom_backend_ids.items()}
+            for node in self.shown_nodes:
+                if node.backend_id in self.node_index:
+                    continue
+                if node.backend_id not in dom_ids:
+                    #Its place in the document is not known, so the tree is loaded again instead
+                    return False
+                node.expanded = True
+                self.ax_nodes[node.node_id] = node
+                anchor = self.find_insert_anchor(dom_ids[node.backend_id])
+                self.full_tree.insert(anchor + 1, node)
+                self.index_nodes([node])
+
+        self.tree_changed([])
+        self.clear_patches()
+        Tracing.annotate(patches=pending, tree_nodes=len(self.node_index))
+        return True
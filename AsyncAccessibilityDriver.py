@@ -0,0 +1,528 @@
+from playwright.async_api import async_playwright
+import asyncio
+import time
+import AccessibilityTree
+import LLMAgent
+import VisionAgent
+import Settings
+import PageLayout
+import PageReadiness
+import ScreenCapture
+import SpeculativeVision
+import Tracing
+import TreeDelta
+from AccessibilityDriver import AgentBrowser, command_trigger, get_commands, parse_command, timed
+
+
+
+
+class AsyncAgentBrowser:
+    """
+    Async version of AgentBrowser built on playwright.async_api, AsyncGroq and AsyncOpenAI.
+
+    Independent work is overlapped, the planner call runs while the first page loads
+    and the accessibility tree, snapshot and layout boxes of a page are fetched at the same time.
+    The incremental tree mode is not used here, the tree is refetched after each command.
+    The per step logic that does no I/O is shared with AgentBrowser.
+
+    Functions:
+    - OutputPage(index=0, instruction=None): Get the output of the website's accessibility tree.
+    - Focus(id): Focus on a specific element by its ID.
+    - LoadPage(): Load the page and initialize the accessibility tree.
+    - UpdateTree(): Refetch the accessibility tree after a command.
+    - Navigate(url="https://example.com"): Navigate to a specified URL.
+    - Expand(params): Expand a node in the accessibility tree.
+    - FetchTree(): Fetch the accessibility tree, snapshot and layout of the page together.
+    - FetchLayout(): Fetch the layout boxes the tree is paged by with Settings.UseViewportPaging.
+    - Scroll(): Scroll down the page.
+    - Click(params): Click on a specific element.
+    - Read(params): Read text content of a specific element.
+    - Find(params): Search every node in the accessibility tree.
+    - Enter(): Simulate pressing the Enter key.
+    - input_command(params): Input text into a specific element.
+    - CreateCommands(com_prompt, count, history): Ask the command agent, through the model cascade when it is on.
+    - ExecuteCommand(command): Execute the given command.
+    - PageChanged(): Start summarizing the current page in the background.
+    - AgentLoop(): Main loop for planner and command creation communication.
+    - UpdatePlan(prompt): Summarize the page and ask the updater for a new plan.
+    """
+    def __init__(self,screenshot_path=None):
+        self.browser = None
+        self.context = None
+        self.page = None
+        self.client = None
+        self.accessibility_tree = None
+        self.current_url = "https://example.com"
+        self.last_result = "(Start of task): No command has been executed yet"
+        self.last_instruction = "No last instruction task has begun"
+        self.website_name = "UNKNOWN SITE"
+        self.original_prompt = ""
+        self.reasoning_history = []
+        self.screenshot_path = screenshot_path
+        #Summarizes each new page in the background so the updater does not wait for the vision model
+        self.speculative_vision = SpeculativeVision.AsyncSpeculativeVision() if Settings.UseSpeculativeVision and Settings.UseUpdater else None
+        #Sends the command agent the full tree once per page and only the changes after that
+        self.tree_conversation = TreeDelta.TreeConversation() if Settings.UseTreeDeltas else None
+        self.trace = []
+        self.timings = {}
+
+    async def run(self):
+        """
+        Launch the browser and run the agent loop until it is closed.
+        """
+        async with async_playwright() as p:
+            self.browser = await p.chromium.launch(channel="chrome", headless=Settings.Headless)
+            await self.open(self.browser)
+            try:
+                await self.AgentLoop()
+            finally:
+                await self.browser.close()
+
+    async def open(self,browser):
+        """
+        Open a page for this session in its own browser context so sessions sharing a browser do not share cookies or storage.
+
+        Args:
+            browser (Browser): The browser to open the context in.
+        """
+        self.browser = browser
+        self.context = await browser.new_context()
+        self.page = await self.context.new_page()
+
+    async def close(self):
+        """
+        Close the browser context of this session.
+        """
+        if self.context is not None:
+            await self.context.close()
+            self.context = None
+
+    #Functions
+    async def Focus(self,id):
+        """
+        Focus on a specific element by sending a DOM focus command with the backend node ID.
+        """
+        await self.client.send('DOM.focus', {'backendNodeId': int(id)})
+
+    async def FetchTree(self):
+        """
+        Fetch the snapshot(only used without UseFullTree), the full accessibility tree and the layout(only with UseViewportPaging) together.
+
+        Returns:
+            tuple: The snapshot, the list of nodes from getFullAXTree and the layout snapshot and metrics or None.
+        """
+        snapshot, response, layout = await asyncio.gather(
+            self.FetchSnapshot(),
+            self.client.send("Accessibility.getFullAXTree"),
+            self.FetchLayout(),
+        )
+        return snapshot, response["nodes"], layout
+
+    #The accessibility snapshot getStartPage matches nodes by, only used without UseFullTree
+    async def FetchSnapshot(self):
+        if Settings.UseFullTree:
+            return None
+        return await self.page.accessibility.snapshot()
+
+    async def LoadPage(self):
+        """
+        Initialize the client for interacting with the page context, enable accessibility, and create the accessibility tree.
+
+        Updates the current URL and sets the website name based on the root AX node.
+        """
+        if self.client is not None:
+            await self.client.detach()
+        self.client = Tracing.trace_cdp(await self.page.context.new_cdp_session(self.page))
+        await self.client.send("Accessibility.enable")
+        snapshot, all_nodes, layout = await self.FetchTree()
+        self.accessibility_tree = AccessibilityTree.AccessibilityTree(self.client, snapshot, all_nodes)
+        if layout is not None:
+            self.accessibility_tree.set_layout(*layout)
+        self.current_url = self.page.url
+        self.website_name = "Website: " + self.accessibility_tree.get_root_name() + '\n'
+
+    async def UpdateTree(self):
+        """
+        Wait for the page to be ready, then refetch the accessibility tree and website name.
+        """
+        with timed(self.timings, "readiness"):
+            await PageReadiness.wait_until_ready_async(self.page, self.client, Settings.Ready_Timeout, "command")
+        with timed(self.timings, "tree"):
+            snapshot, all_nodes, layout = await self.FetchTree()
+            self.accessibility_tree.load_tree(snapshot, all_nodes)
+            if layout is not None:
+                self.accessibility_tree.set_layout(*layout)
+        self.current_url = self.page.url
+        self.website_name = "Website: " + self.accessibility_tree.get_root_name() + '\n'
+        await self.PageChanged()
+
+    async def PageChanged(self):
+        """
+        Start summarizing the current page in the background when Settings.UseSpeculativeVision is on.
+        """
+        if self.speculative_vision is not None:
+            with timed(self.timings, "speculative_capture"):
+                await self.speculative_vision.page_changed(self.client, self.website_name)
+
+    async def Navigate(self,url="https://example.com"):
+        """
+        Navigate to a specified URL, load the page, and update the accessibility tree.
+
+        Args:
+            url (str): The URL to navigate to (default is "https://example.com").
+
+        Returns:
+            str: A message indicating the navigation to the specified URL.
+        """
+        to_url = url.replace('"','').replace("'",'')
+        await self.page.goto(to_url)
+        await self.LoadPage()
+        return f"Navigated to {to_url}"
+
+    def Expand(self,params):
+        """
+        Expand a node in the accessibility tree based on the provided parameters.
+
+        Args:
+            params (list): List containing the parameters for expanding the node.
+
+        Returns:
+            str: The result of expanding the specified node.
+        """
+        node_id = params[0]
+        if self.accessibility_tree.getNodeByDomId(node_id) is None:
+            return f"Exception: Node {node_id} is not in the current tree"
+        return self.accessibility_tree.expand_node(node_id)
+
+    async def FetchLayout(self):
+        """
+        Fetch the layout snapshot and metrics the tree is paged by together.
+
+        Returns:
+            tuple: The DOMSnapshot.captureSnapshot and Page.getLayoutMetrics responses, None without Settings.UseViewportPaging.
+        """
+        if not Settings.UseViewportPaging:
+            return None
+        return await asyncio.gather(
+            self.client.send("DOMSnapshot.captureSnapshot", PageLayout.SNAPSHOT_PARAMS),
+            self.client.send("Page.getLayoutMetrics"),
+        )
+
+    async def Scroll(self):
+        """
+        Increment the chunk index for scrolling, scroll down the page, and handle reaching the end of the page.
+
+        With Settings.UseViewportPaging the page is scrolled by exactly one screen instead and the tree
+        shows the nodes on the new screen once it is reloaded.
+
+        Returns:
+            str: The result of the scroll operation or an exception message if the end of the page is reached.
+        """
+        if Settings.UseViewportPaging and self.accessibility_tree.viewport is not None:
+            return await self.ScrollViewport()
+        self.accessibility_tree.chunk_index += 1
+
+        scroll_to = int(min([len(self.accessibility_tree.full_tree)-1,(self.accessibility_tree.chunk_index * self.accessibility_tree.chunk_length)]))
+        if len(self.accessibility_tree.full_tree) > scroll_to:
+            await self.page.mouse.wheel(0, 250)
+            scroll_node = self.accessibility_tree.full_tree[scroll_to]
+            scroll_id = scroll_node.backend_id
+            await self.client.send('DOM.scrollIntoViewIfNeeded', {'backendNodeId': int(scroll_id)})
+            await PageReadiness.wait_until_ready_async(self.page, self.client, Settings.Scroll_Ready_Timeout, "scroll")  # Allow scrolled elements to load
+            return "Scrolled down"
+        self.accessibility_tree.chunk_index = 0
+        return "Exception: Failed to scroll end of page reached"
+
+    async def ScrollViewport(self):
+        """
+        Scroll the window down by one viewport height.
+
+        Pages that scroll an inner element instead of the window are scrolled with the mouse wheel.
+
+        Returns:
+            str: The result of the scroll operation or an exception message if the end of the page is reached.
+        """
+        top, height, page_height = self.accessibility_tree.viewport
+        if page_height > height:
+            if self.accessibility_tree.at_page_end():
+                return "Exception: Failed to scroll end of page reached"
+            await self.page.evaluate("y => window.scrollTo(0, y)", top + height)
+        else:
+            await self.page.mouse.wheel(0, height)
+        await PageReadiness.wait_until_ready_async(self.page, self.client, Settings.Scroll_Ready_Timeout, "scroll")
+        return "Scrolled down"
+
+    async def Click(self,params):
+        """
+        Click on a specific element identified by the node ID in the accessibility tree.
+
+        Args:
+            params (list): List containing the node ID of the element to click.
+
+        Returns:
+            str: A message indicating that the element was clicked.
+        """
+        node_id = params[0]
+
+        current_node = self.accessibility_tree.getNodeByDomId(node_id)
+        if current_node is None:
+            return f"Exception: Node {node_id} is not in the current tree"
+        await self.Focus(node_id)
+        focused_element = await self.page.evaluate_handle('document.activeElement')
+        await focused_element.click()
+        return "Clicked " + current_node.name
+
+    async def Read(self,params):
+        """
+        Read the text content of a specific element identified by the node ID in the accessibility tree.
+
+        Args:
+            params (list): List containing the node ID of the element to read.
+
+        Returns:
+            str: The text content read from the element.
+        """
+        node_id = params[0]
+        if self.accessibility_tree.getNodeByDomId(node_id) is None:
+            return f"Exception: Node {node_id} is not in the current tree"
+
+        await self.Focus(node_id)
+        focused_element = await self.page.evaluate_handle('document.activeElement')
+        return f"Text Read: {await focused_element.text_content()}"
+
+    async def Enter(self):
+        """
+        Presses the Enter key on the currently focused element.
+
+        Returns:
+            str: A message indicating that Enter key was pressed.
+        """
+        focused_element = await self.page.evaluate_handle('document.activeElement')
+        await focused_element.press('Enter')
+        return "Pressed Enter"
+
+    async def input_command(self,params):
+        """
+        Inputs text into the specified node element.
+
+        Args:
+            params (list): A list containing the node ID and text to input.
+
+        Returns:
+            str: A message indicating the text that was inputted.
+        """
+        node_id = params[0]
+
+        current_node = self.accessibility_tree.getNodeByDomId(node_id)
+        if current_node is None:
+            return f"Exception: Node {node_id} is not in the current tree"
+
+        await self.Focus(node_id)
+        focused_element = await self.page.evaluate_handle('document.activeElement')
+
+        await focused_element.type(params[1])
+        return f"Inputted the text {params[1]} to " + current_node.name
+
+    async def CreateCommands(self,com_prompt,count=1,history=None):
+        """
+        Ask the command agent for the command of an instruction, through the model cascade with Settings.UseModelCascade.
+
+        Args:
+            com_prompt (str): The tree and instruction.
+            count (int): The max number of commands(default is 1).
+            history (list): The messages before the prompt in the tree delta conversation(default is None).
+
+        Returns:
+            str: The command plan.
+        """
+        if not Settings.UseModelCascade:
+            return await LLMAgent.create_commands_async(com_prompt, self.website_name, self.timings, count, history=history)
+        return (await LLMAgent.command_cascade.run_async(
+            lambda model: LLMAgent.create_commands_async(com_prompt, self.website_name, self.timings, count, model, history),
+            lambda command_plan: command_trigger(command_plan, self.accessibility_tree),
+        ))[0]
+
+    #Find the desired command and extract the parameters for a function call
+    async def ExecuteCommand(self,command):
+        """
+        Executes the specified command by parsing it and calling the corresponding method.
+
+        Args:
+            command (str): The command to be executed.
+
+        Returns:
+            str: The result or message after executing the command.
+        """
+        name, params = parse_command(command)
+        try:
+            if name == 'Input':
+                return await self.input_command(params)
+            elif name == 'Navigate':
+                return await self.Navigate(params[0])
+            elif name == 'Click':
+                return await self.Click(params)
+            elif name == 'Find':
+                return self.Find(params)
+            elif name == 'EndTask':
+                return "Task End - summarize what you did"
+            elif name == 'Scroll':
+                return await self.Scroll()
+            elif name == 'Expand':
+                return self.Expand(params)
+            elif name == 'Read':
+                return await self.Read(params)
+            elif name == 'Enter':
+                return await self.Enter()
+            else:
+                return "Exception: Unknown Command"
+        except Exception as e:
+            print(e)
+            return f"Exception failed to execute: {command}"
+
+    #Main agent loop(Prompts the user for tasks)
+    async def AgentLoop(self):
+        """
+        Prompts for tasks and runs each one until the browser is closed.
+        """
+        while True:
+            prompt = await asyncio.to_thread(input, "Prompt AI to complete task:\n")
+            try:
+                result = await self.run_task(prompt)
+            except Exception as e:
+                #A failed LLM call(after its retries) ends the task, not the agent
+                print(f"Task failed: {e!r}")
+                continue
+            if result["status"] == "completed":
+                await asyncio.to_thread(input, "Task completed! press any key to do another:")
+
+    #Planner and command creator communication for a single task
+    async def run_task(self,prompt):
+        """
+        Executes a loop for the AI agent to interact with a web page based on given instructions and commands.
+
+        Args:
+            prompt (str): The task to complete.
+
+        Returns:
+            dict: The prompt, status("completed" or "failed"), attempts used, command trace and per stage timings.
+        """
+        starting_page = "https://example.com"
+        if Settings.Initial_Page is not None:
+            starting_page = Settings.Initial_Page
+        #The starting page loads while the planner runs
+        task_start = time.perf_counter()
+        Tracing.new_lane()
+        self.trace = []
+        self.timings = {}
+        navigation = Tracing.create_task(self.TimedNavigate(starting_page))
+        self.original_prompt = prompt
+        self.last_result = "(Start of task): No command has been executed yet"
+        try:
+            if Settings.UsePlanner:
+                with timed(self.timings, "planner"):
+                    prompt = await LLMAgent.create_planner_async(prompt)
+        finally:
+            await navigation
+        await self.PageChanged()
+        attempts = 0
+        print(prompt)
+        while True:
+            if attempts > Settings.Max_Attempts:
+                break
+            self.StartAttempt(prompt)
+            i = 0
+            while i < len(self.instruction_list): #Cheesy for loop so i can change iterator
+                instruction = self.instruction_list[i]
+                if len(instruction) < 3:
+                    i += 1
+                    continue
+                if instruction.lower().find("loop") == 0:
+                    i = 0
+                    continue
+                print("\nStep: " + str(i))
+                print(instruction)
+                step_start = time.perf_counter()
+                command_plan, request = self.PrepareStep(i, instruction)
+                if command_plan is None:
+                    with timed(self.timings, "commands"):
+                        command_plan = await self.CreateCommands(*request)
+                    self.CommandsAnswered(command_plan)
+                #Only the first command of a batched response belongs to this instruction
+                command = next(iter(get_commands(command_plan)), "")
+                self.LogReasoning(i, instruction, command_plan)
+                if command.lower().find("exception") != -1: #Command maker decided it could not find the node
+                    print("Could not find NODE!")
+                    self.last_result = command.strip()
+                    self.RecordStep(attempts, i, instruction, command, step_start)
+                    break
+                self.RememberCommand(instruction, command)
+                with timed(self.timings, "execute"):
+                    self.last_result = await self.ExecuteCommand(command)
+                outcome = self.StepOutcome(instruction, command)
+                if outcome == "next":
+                    await self.UpdateTree()
+                self.RecordStep(attempts, i, instruction, command, step_start)
+                if outcome == "failed":
+                    break
+                if outcome == "next":
+                    i += 1
+            if self.last_result.lower().find("exception") == 0:
+                if not Settings.UseUpdater:
+                    break
+                prompt = await self.UpdatePlan(prompt)
+                attempts += 1
+                continue
+
+            self.StoreCommands()
+            return self.TaskResult("completed", attempts, task_start)
+        return self.TaskResult("failed", attempts, task_start)
+
+    async def UpdatePlan(self,prompt):
+        """
+        Summarize the current page and ask the updater for a new plan after an attempt failed.
+
+        Args:
+            prompt (str): The plan that failed.
+
+        Returns:
+            str: The updated plan.
+        """
+        #Add code to update planner with screenshot of page
+        with timed(self.timings, "vision"):
+            image, image_hash = await ScreenCapture.capture_async(self.client)
+            if self.screenshot_path is not None:
+                with open(self.screenshot_path, "wb") as screenshot:
+                    screenshot.write(image)
+            page_summary = None
+            if self.speculative_vision is not None:
+                page_summary = await self.speculative_vision.summary(self.website_name, image_hash)
+            if page_summary is None:
+                page_summary = await VisionAgent.PromptVisionAsync(image,self.website_name,image_hash)
+        print(f"Summary of page: {page_summary}")
+        with timed(self.timings, "updater"):
+            prompt = await LLMAgent.update_plan_async(prompt, self.original_prompt, self.website_name, self.reasoning_history, page_summary)
+        print("Update Plan Agent:\n" + prompt)
+        return prompt
+
+    async def TimedNavigate(self,url):
+        with timed(self.timings, "navigate"):
+            return await self.Navigate(url)
+
+    #The tree output, Find, trace and result records and the per step logic are shared with the sync driver, none of it does page or LLM I/O
+    OutputPage = AgentBrowser.OutputPage
+    Find = AgentBrowser.Find
+    RecordStep = AgentBrowser.RecordStep
+    TaskResult = AgentBrowser.TaskResult
+    StartAttempt = AgentBrowser.StartAttempt
+    PrepareStep = AgentBrowser.PrepareStep
+    CommandsAnswered = AgentBrowser.CommandsAnswered
+    RememberCommand = AgentBrowser.RememberCommand
+    StoreCommands = AgentBrowser.StoreCommands
+    StepOutcome = AgentBrowser.StepOutcome
+    LogReasoning = AgentBrowser.LogReasoning
+
+def run():
+    """
+    Run the async agent browser until it is closed.
+    """
+    asyncio.run(AsyncAgentBrowser().run())
@@ -0,0 +1,104 @@
+import asyncio
+import json
+import os
+import LLMAgent
+import SessionPool
+import Settings
+
+
+#Keys a task id or prompt may be stored under in a task file, the first one present is used
+TASK_ID_KEYS = ("task_id", "request_id", "id")
+PROMPT_KEYS = ("prompt", "task", "body")
+
+#Tasks with a result in one of these states are skipped when a batch is resumed
+FINISHED_STATUSES = ("completed", "failed")
+
+
+def load_tasks(task_path):
+    """
+    Read the tasks of a JSONL task file, one JSON object per line.
+
+    Args:
+        task_path (str): Path of the task file.
+
+    Returns:
+        list: The tasks as dicts with "task_id" and "prompt" keys.
+    """
+    tasks = []
+    with open(task_path, encoding="utf-8") as task_file:
+        for line_number, line in enumerate(task_file, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            task_id = next((record[key] for key in TASK_ID_KEYS if key in record), f"line-{line_number}")
+            prompt = next((record[key] for key in PROMPT_KEYS if key in record), None)
+            if prompt is None:
+                print(f"Skipping task {task_id}: no prompt")
+                continue
+            tasks.append({"task_id": str(task_id), "prompt": prompt})
+    return tasks
+
+
+def finished_task_ids(output_path):
+    """
+    Return the ids of the tasks that already have a finished result in the output file.
+
+    Args:
+        output_path (str): Path of the JSONL result file.
+
+    Returns:
+        set: The finished task ids.
+    """
+    finished = set()
+    if not os.path.exists(output_path):
+        return finished
+    with open(output_path, encoding="utf-8") as output_file:
+        for line in output_file:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                #A partial line left by a crash
+                continue
+            if result.get("status") in FINISHED_STATUSES:
+                finished.add(str(result["task_id"]))
+    return finished
+
+
+def run_batch(task_path, output_path, sessions=None):
+    """
+    Run every unfinished task of a JSONL task file headless, without prompts, and append one result per task to output_path.
+
+    Each result record has the task id, status, attempts used, the command trace and the seconds spent per stage.
+    Tasks already finished in output_path are skipped, so a crashed batch can be resumed by running it again.
+
+    Args:
+        task_path (str): Path of the JSONL task file.
+        output_path (str): Path of the JSONL result file.
+        sessions (int): The number of tasks run at once(default is Settings.Max_Sessions).
+
+    Returns:
+        list: The results of the tasks run.
+    """
+    Settings.Headless = True
+    finished = finished_task_ids(output_path)
+    tasks = [task for task in load_tasks(task_path) if task["task_id"] not in finished]
+    print(f"{len(tasks)} tasks to run, {len(finished)} already finished")
+    if not tasks:
+        return []
+
+    with open(output_path, "a+", encoding="utf-8") as output_file:
+        #Start on a fresh line if a crash left a partial record behind
+        if output_file.tell() > 0:
+            output_file.seek(output_file.tell() - 1)
+            if output_file.read(1) != "\n":
+                output_file.write("\n")
+
+        def write_result(result):
+            output_file.write(json.dumps(result) + "\n")
+            output_file.flush()
+            print(f"Task {result['task_id']}: {result['status']}")
+
+        results = asyncio.run(SessionPool.run_sessions(tasks, sessions, write_result))
+    if Settings.UseModelCascade:
+        print("Model cascade: " + json.dumps(LLMAgent.cascade_stats()))
+    return results
@@ -0,0 +1,128 @@
+import re
+import sqlite3
+import threading
+import time
+
+
+#Commands whose first parameter is the id of a node in the tree
+NODE_COMMANDS = ("Click", "Input", "Read", "Expand")
+
+#Stands in for the node id in a stored command, it is replaced by the id of the matching node on reuse
+NODE_PLACEHOLDER = "<node>"
+
+
+#Lowercase the instruction and collapse whitespace and surrounding punctuation so trivial rewordings share an entry
+def normalize_instruction(instruction):
+    return re.sub(r"\s+", " ", instruction).strip(" .!\t").lower()
+
+
+class CommandMemo:
+    """
+    Memo of resolved commands keyed on website name and normalized instruction, stored in SQLite.
+
+    Node commands are stored with the role and name of the node they targeted instead of its id,
+    since ids change between page loads. A stored command is only reused if a node with the same
+    role and name exists in the current tree, and it is rewritten to that node's id.
+
+    Functions:
+    - lookup(website_name, instruction, tree): Return a command plan for the instruction or None.
+    - prepare(command, params, tree): Capture the target of a command before it is executed.
+    - store(website_name, instruction, entry): Remember a prepared command after it succeeded.
+    - stats(): Return the hit/miss counters.
+    """
+
+    def __init__(self, path):
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS commands ("
+            "website TEXT, instruction TEXT, command TEXT, role TEXT, name TEXT, updated REAL, "
+            "PRIMARY KEY (website, instruction))"
+        )
+        self.connection.commit()
+
+    def lookup(self, website_name, instruction, tree):
+        """
+        Return a command plan for the instruction if one was stored and its target is still on the page.
+
+        Args:
+            website_name (str): Name of the website being interacted with.
+            instruction (str): The instruction to resolve.
+            tree (AccessibilityTree): The current accessibility tree.
+
+        Returns:
+            str: A command plan in the same format as create_commands or None on a miss.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT command, role, name FROM commands WHERE website = ? AND instruction = ?",
+                (website_name, normalize_instruction(instruction)),
+            ).fetchone()
+        command = None
+        if row is not None:
+            command, role, name = row
+            if role is None and command.split("(")[0].strip(" `").endswith(NODE_COMMANDS):
+                #A node command stored with its literal id, the id may belong to another node now
+                command = None
+            elif role is not None:
+                node = tree.getNodeByRoleName(role, name)
+                command = None if node is None else command.replace(NODE_PLACEHOLDER, str(node.backend_id), 1)
+        if command is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return "Thought:\nReusing the command resolved for this instruction on a previous run\nCommand: " + command
+
+    def prepare(self, name, params, tree):
+        """
+        Capture the target of a command before it is executed, since executing it may change the tree.
+
+        Only the parsed command is stored, so text around it in the response(backticks, numbering...) is not kept.
+
+        Args:
+            name (str): The name of the command about to be executed, as parsed by the driver, None if it is unknown.
+            params (list): The parameters of the command.
+            tree (AccessibilityTree): The current accessibility tree.
+
+        Returns:
+            tuple: The command with its node id replaced by a placeholder and the role and name of the node,
+            or None if the command cannot be reused.
+        """
+        if name is None or name == "Find":
+            #Searching is part of resolving the instruction, not its result
+            return None
+        if name not in NODE_COMMANDS:
+            return f"{name}({','.join(params)})", None, None
+        node = tree.getNodeByDomId(params[0])
+        if node is None or node.name is None:
+            return None
+        return f"{name}({','.join([NODE_PLACEHOLDER] + params[1:])})", node.role, node.name
+
+    def store(self, website_name, instruction, entry):
+        """
+        Remember a prepared command after it was executed successfully.
+
+        Args:
+            website_name (str): Name of the website being interacted with.
+            instruction (str): The instruction that was resolved.
+            entry (tuple): The result of prepare.
+        """
+        if entry is None:
+            return
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO commands VALUES (?, ?, ?, ?, ?, ?)",
+                (website_name, normalize_instruction(instruction), *entry, time.time()),
+            )
+            self.connection.commit()
+
+    def stats(self):
+        """
+        Return the hit/miss counters.
+
+        Returns:
+            dict: hits and misses.
+        """
+        return {"hits": self.hits, "misses": self.misses}
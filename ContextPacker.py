@@ -0,0 +1,95 @@
+import re
+
+
+#Words of an instruction that say what to do rather than which node to do it to
+INSTRUCTION_WORDS = {
+    "a", "an", "and", "the", "to", "into", "in", "on", "of", "for", "that", "this", "it", "is",
+    "click", "input", "type", "enter", "press", "navigate", "go", "goto", "scroll", "down", "up",
+    "find", "select", "first", "then", "with", "page", "button", "link",
+}
+
+#Marks lines that were left out of the packed output
+GAP_LINE = "..."
+
+
+#Rough token count of a piece of text(about four characters per token for English and ids)
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+#The instruction without the words that do not describe the target node
+def instruction_query(instruction):
+    words = re.findall(r"\w+", instruction.lower())
+    return " ".join(word for word in words if word not in INSTRUCTION_WORDS) or instruction
+
+
+def pack_tree(tree, instruction, token_budget, neighbors=1):
+    """
+    Pack the nodes most relevant to an instruction into a token budget.
+
+    Every shown node from the start of the tree's current chunk on is scored against the instruction with
+    the tree's search index, so a Scroll moves the packed window down the page. Nodes are taken best first,
+    each one with its neighbouring lines and the lines of its expanded ancestors, until the budget is full.
+    Whatever budget is left goes to the top of the chunk in document order.
+    The lines are output in document order with "..." where lines were left out.
+
+    Args:
+        tree (AccessibilityTree): The tree to pack.
+        instruction (str): The instruction the command agent has to resolve.
+        token_budget (int): The max estimated tokens of the output.
+        neighbors (int): The number of lines kept on each side of a relevant node.
+
+    Returns:
+        str: The packed tree followed by the number of nodes left out.
+    """
+    shown = list(tree.iter_shown(tree.full_tree))
+    lines = [("    " * level) + tree.node_line(node) for node, level in shown]
+    positions = {id(node): i for i, (node, level) in enumerate(shown)}
+    costs = [estimate_tokens(line) for line in lines]
+    chunk = tree.chunk_nodes()
+    start = positions.get(id(chunk[0]), 0) if chunk else 0
+    selected = set()
+    used = estimate_tokens(GAP_LINE)
+
+    #Index of the closest line above each line with a lower indentation level
+    def ancestors(i):
+        level = shown[i][1]
+        for j in range(i - 1, -1, -1):
+            if level == 0:
+                break
+            if shown[j][1] < level:
+                level = shown[j][1]
+                yield j
+
+    def take(group):
+        nonlocal used
+        group = [i for i in group if i not in selected]
+        cost = sum(costs[i] + 1 for i in group)
+        if used + cost > token_budget:
+            return False
+        selected.update(group)
+        used += cost
+        return True
+
+    for score, node in tree.rank_nodes(instruction_query(instruction), len(lines)):
+        if positions.get(id(node), -1) < start:
+            continue
+        i = positions[id(node)]
+        nearby = range(max(0, i - neighbors), min(len(lines), i + neighbors + 1))
+        if not take([*ancestors(i), *nearby]):
+            #Fall back to the node alone when its context does not fit
+            take([i])
+    for i in range(start, len(lines)):
+        if not take([i]):
+            break
+
+    output_lines = []
+    previous = -1
+    for i in sorted(selected):
+        if i != previous + 1:
+            output_lines.append(GAP_LINE)
+        output_lines.append(lines[i])
+        previous = i
+    if previous != len(lines) - 1:
+        output_lines.append(GAP_LINE)
+    output_lines.append("\n +" + str(len(lines) - len(selected)) + " ...Nodes not shown, Find() can search them")
+    return "\n".join(output_lines)
@@ -1,23 +1,63 @@
-from typing import Final
+import re
+import time
+import LLMClients
+import ModelCascade
+import ResponseCache
+import Settings
 
-from groq import Groq
-from dotenv import load_dotenv
-import os
 
-
-load_dotenv()
-GROQKEY: Final[str] = os.getenv('GROQ_APIKEY')
-groq_client = Groq(api_key=GROQKEY)
+response_cache = None
+if Settings.UseResponseCache:
+    response_cache = ResponseCache.ResponseCache(
+        Settings.Response_Cache_Path,
+        Settings.Response_Cache_Max_MB * 1024 * 1024,
+        Settings.Response_Cache_Max_Age,
+    )
+#A "Command:" title at the start of a line, the command follows on the same or the next line
+COMMAND_TITLE = re.compile(r"^[ \t*#`]*command:[ \t*`]*", re.IGNORECASE | re.MULTILINE)
+#Model cascades of the agents, only used with Settings.UseModelCascade
+planner_cascade = ModelCascade.ModelCascade("planner", Settings.Planner_Models)
+updater_cascade = ModelCascade.ModelCascade("updater", Settings.Planner_Models)
+command_cascade = ModelCascade.ModelCascade("commands", Settings.Command_Models)
+#Totals over every streamed request, see stream_stats
+stream_totals = {"requests": 0, "early_stops": 0, "first_token": 0.0, "time_to_command": 0.0}
 
 
-def prompt_groq(prompts,sysprompt="You are an AI assistant",modelName="llama3-8b-8192"):
+def prompt_groq(prompts,sysprompt="You are an AI assistant",modelName="llama3-8b-8192",use_cache=True):
     """
     Prompt the Groq chatbot with a list of prompts and return the response.
 
+    Identical requests are answered from the response cache when Settings.UseResponseCache is on.
+
+    Args:
+        prompts (list): List of prompts to send to the chatbot.
+        sysprompt (str): System prompt to start the conversation.
+        modelName (str): Name of the model to use for the chatbot.
+        use_cache (bool): Whether or not the response cache may be used for this request.
+
+    Returns:
+        str: The response from the chatbot.
+
+    Raises:
+        None
+    """
+    request = groq_request(prompts, sysprompt, modelName)
+    cache_key, response = cache_lookup(request, use_cache)
+    if response is not None:
+        return response
+    completion = LLMClients.groq_provider.complete(request)
+    return cache_store(cache_key, completion.choices[0].message.content)
+
+
+async def prompt_groq_async(prompts,sysprompt="You are an AI assistant",modelName="llama3-8b-8192",use_cache=True):
+    """
+    Async version of prompt_groq using the AsyncGroq client.
+
     Args:
         prompts (list): List of prompts to send to the chatbot.
         sysprompt (str): System prompt to start the conversation.
         modelName (str): Name of the model to use for the chatbot.
+        use_cache (bool): Whether or not the response cache may be used for this request.
 
     Returns:
         str: The response from the chatbot.
@@ -25,17 +65,279 @@ def prompt_groq(prompts,sysprompt="You are an AI assistant",modelName="llama3-8b
     Raises:
         None
     """
+    request = groq_request(prompts, sysprompt, modelName)
+    cache_key, response = cache_lookup(request, use_cache)
+    if response is not None:
+        return response
+    completion = await LLMClients.groq_provider.complete_async(request)
+    return cache_store(cache_key, completion.choices[0].message.content)
+
+
+def prompt_groq_stream(prompts,sysprompt="You are an AI assistant",modelName="llama3-8b-8192",stop_when=None,metrics=None,use_cache=True):
+    """
+    Prompt the Groq chatbot with streaming and stop reading as soon as stop_when says the response is complete.
+
+    Closing the stream cancels the rest of the generation, so the tokens after the part that is needed are never waited for.
+
+    Args:
+        prompts (list): List of prompts to send to the chatbot.
+        sysprompt (str): System prompt to start the conversation.
+        modelName (str): Name of the model to use for the chatbot.
+        stop_when (function): Called with the text so far after every token, returns True to stop.
+        metrics (dict): Seconds to the first token and to the stop are added under "first_token" and "time_to_command".
+        use_cache (bool): Whether or not the response cache may be used for this request.
+
+    Returns:
+        str: The response from the chatbot up to where it was stopped.
+    """
+    request = groq_request(prompts, sysprompt, modelName, stream=True)
+    cache_key, response = cache_lookup(request, use_cache)
+    if response is not None:
+        return response
+    reader = StreamReader(stop_when, metrics)
+    with LLMClients.groq_provider.stream(request) as stream:
+        for chunk in stream:
+            if reader.feed(chunk):
+                break
+    return cache_store(cache_key, reader.finish())
+
+
+async def prompt_groq_stream_async(prompts,sysprompt="You are an AI assistant",modelName="llama3-8b-8192",stop_when=None,metrics=None,use_cache=True):
+    """
+    Async version of prompt_groq_stream using the AsyncGroq client.
+
+    Returns:
+        str: The response from the chatbot up to where it was stopped.
+    """
+    request = groq_request(prompts, sysprompt, modelName, stream=True)
+    cache_key, response = cache_lookup(request, use_cache)
+    if response is not None:
+        return response
+    reader = StreamReader(stop_when, metrics)
+    async with LLMClients.groq_provider.stream_async(request) as stream:
+        async for chunk in stream:
+            if reader.feed(chunk):
+                break
+    return cache_store(cache_key, reader.finish())
+
+
+class StreamReader:
+    """
+    Collects the tokens of a streamed response and times them.
+
+    Functions:
+    - feed(chunk): Add a streamed chunk, returns True once the response should be stopped.
+    - finish(): Record the timings and return the text.
+    """
+
+    def __init__(self,stop_when=None,metrics=None):
+        self.stop_when = stop_when
+        self.metrics = metrics
+        self.start = time.perf_counter()
+        self.first_token = None
+        self.stopped = False
+        self.text = ""
+
+    def feed(self,chunk):
+        if not chunk.choices or not chunk.choices[0].delta.content:
+            return False
+        if self.first_token is None:
+            self.first_token = time.perf_counter() - self.start
+        self.text += chunk.choices[0].delta.content
+        self.stopped = self.stop_when is not None and self.stop_when(self.text)
+        return self.stopped
+
+    def finish(self):
+        elapsed = time.perf_counter() - self.start
+        first_token = elapsed if self.first_token is None else self.first_token
+        stream_totals["requests"] += 1
+        stream_totals["early_stops"] += self.stopped
+        stream_totals["first_token"] += first_token
+        stream_totals["time_to_command"] += elapsed
+        if self.metrics is not None:
+            self.metrics["first_token"] = self.metrics.get("first_token", 0) + first_token
+            self.metrics["time_to_command"] = self.metrics.get("time_to_command", 0) + elapsed
+        return self.text
+
+
+def parse_commands(text,finished=True):
+    """
+    Read the commands of a command agent response, in order.
+
+    Only a "Command:" title at the start of a line counts, so a command mentioned in the thought is skipped.
+    A command is complete once its line ended(or the response did), while streaming its parentheses also have to be
+    balanced, e.g. Input(22, Hello (world)) is not cut at the first closing parenthesis.
+    A whole response without such a title is read from a "Command:" anywhere, e.g. "Thought: ... Command: Click(88)".
+
+    Args:
+        text (str): The response, or the part streamed so far.
+        finished (bool): Whether the response is whole, its last line then counts as ended(default is True).
+
+    Returns:
+        list: The complete commands, without their title and surrounding backticks.
+    """
+    commands = []
+    for title in COMMAND_TITLE.finditer(text):
+        rest = text[title.end():].lstrip(" \t\n`")
+        line_end = rest.find("\n")
+        if line_end == -1 and not finished:
+            break
+        command = (rest if line_end == -1 else rest[:line_end]).strip().strip("`").strip()
+        if not command or (not finished and not balanced(command)):
+            break
+        commands.append(command)
+    if finished and not commands:
+        parts = re.split("command:", text, flags=re.IGNORECASE)[1:]
+        commands = [part.strip().strip("`").split("\n")[0].strip().strip("`") for part in parts if part.strip()]
+    return commands
+
+#Whether every parenthesis of a command is closed, in order
+def balanced(command):
+    depth = 0
+    for char in command:
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+            if depth < 0:
+                return False
+    return depth == 0
+
+#Whether a streamed command agent response already has its complete command
+def command_complete(text):
+    return len(parse_commands(text, finished=False)) >= 1
+
+#The stop condition of a streamed response that may carry count commands
+def commands_complete(count):
+    if count == 1:
+        return command_complete
+    return lambda text: len(parse_commands(text, finished=False)) >= count
+
+
+def stream_stats():
+    """
+    Return the counters of the streamed requests.
+
+    Returns:
+        dict: requests, early_stops and the mean seconds to the first token and to the command.
+    """
+    requests = stream_totals["requests"]
+    return {
+        "requests": requests,
+        "early_stops": stream_totals["early_stops"],
+        "mean_first_token": round(stream_totals["first_token"] / requests, 3) if requests else None,
+        "mean_time_to_command": round(stream_totals["time_to_command"] / requests, 3) if requests else None,
+    }
+
+
+def groq_request(prompts,sysprompt,modelName,stream=False):
+    """
+    Build the chat completion request sent to Groq.
+
+    Args:
+        prompts (list): List of prompts to send to the chatbot.
+        sysprompt (str): System prompt to start the conversation.
+        modelName (str): Name of the model to use for the chatbot.
+        stream (bool): Whether or not the response is streamed.
+
+    Returns:
+        dict: The keyword arguments for chat.completions.create.
+    """
     msgs = [{"role": "system", "content": sysprompt}]
 
     msgs.extend(iter(prompts))
-    completion = groq_client.chat.completions.create(
+    return dict(
         model=modelName,
         messages=msgs,
         temperature=0,
         max_tokens=1200,
-        stream=False
+        stream=stream
     )
-    return completion.choices[0].message.content
+
+
+def cache_lookup(request,use_cache=True):
+    """
+    Look up a request in the response cache.
+
+    Args:
+        request (dict): The request from groq_request.
+        use_cache (bool): Whether or not the cache may be used for this request.
+
+    Returns:
+        tuple: The cache key(None when the cache is not used) and the cached response or None.
+    """
+    if response_cache is None or not use_cache:
+        return None, None
+    cache_key = response_cache.make_key(request)
+    return cache_key, response_cache.get(cache_key)
+
+
+def cache_store(cache_key,response):
+    """
+    Store a response under a key from cache_lookup and return it.
+    """
+    if cache_key is not None and response is not None:
+        response_cache.put(cache_key, response)
+    return response
+
+
+def cache_stats():
+    """
+    Return the hit/miss counters of the response cache.
+
+    Returns:
+        dict: hits, misses, entries and bytes, or None when the cache is off.
+    """
+    return None if response_cache is None else response_cache.stats()
+
+
+#Why a plan should go to a bigger model: it has no instructions to run
+def plan_trigger(plan):
+    title = plan.lower().find("instructions:")
+    if title == -1 or not any(len(line.strip()) >= 3 for line in plan[title + 13:].split("\n")):
+        return "parse"
+    return None
+
+
+def prompt_cascade(cascade,request,check):
+    """
+    Prompt through a model cascade when Settings.UseModelCascade is on, otherwise with the request's own model.
+
+    Args:
+        cascade (ModelCascade): The cascade of the agent.
+        request (tuple): The prompts, system prompt and model name.
+        check (function): Returns the trigger that escalates an answer or None to accept it.
+
+    Returns:
+        str: The accepted response.
+    """
+    prompts, sysprompt, model = request
+    if not Settings.UseModelCascade:
+        return prompt_groq(prompts, sysprompt, model)
+    return cascade.run(lambda tier_model: prompt_groq(prompts, sysprompt, tier_model), check)[0]
+
+
+async def prompt_cascade_async(cascade,request,check):
+    """
+    Async version of prompt_cascade.
+
+    Returns:
+        str: The accepted response.
+    """
+    prompts, sysprompt, model = request
+    if not Settings.UseModelCascade:
+        return await prompt_groq_async(prompts, sysprompt, model)
+    return (await cascade.run_async(lambda tier_model: prompt_groq_async(prompts, sysprompt, tier_model), check))[0]
+
+
+def cascade_stats():
+    """
+    Return the per tier counters of every model cascade.
+
+    Returns:
+        dict: Cascade name to the requests, accept rate, triggers and mean seconds of each of its models.
+    """
+    return {cascade.name: cascade.stats() for cascade in (planner_cascade, updater_cascade, command_cascade)}
 
 
 def create_planner(prompt):
@@ -51,6 +353,32 @@ def create_planner(prompt):
     Raises:
         None
     """
+    return prompt_cascade(planner_cascade, planner_request(prompt), plan_trigger)
+
+
+async def create_planner_async(prompt):
+    """
+    Async version of create_planner.
+
+    Args:
+        prompt (str): The prompt to start the planner process.
+
+    Returns:
+        str: The response from the chatbot after generating the planner instructions.
+    """
+    return await prompt_cascade_async(planner_cascade, planner_request(prompt), plan_trigger)
+
+
+def planner_request(prompt):
+    """
+    Build the prompts, system prompt and model name for the planner.
+
+    Args:
+        prompt (str): The prompt to start the planner process.
+
+    Returns:
+        tuple: The prompts, system prompt and model name to pass to prompt_groq.
+    """
     PlannerPrompt = '''You are a self operating web browser.
     Your task is to think through and then create a list of instructions to carry out the given task.
     Your instructions will be passed to a human.
@@ -87,7 +415,7 @@ def create_planner(prompt):
     This example shows the proper format your output should be
 '''
     prompts = [{"role": "user", "content": prompt}]
-    return prompt_groq(prompts, PlannerPrompt,modelName="llama3-70b-8192")
+    return prompts, PlannerPrompt, Settings.Planner_Models[-1]
 def update_plan(plan,original_prompt,webname="default",reasoning_steps=None,page_summary="No website shown"):
     """
     Update a planner by revising a list of instructions based on the last plan, current webpage layout, reasoning steps, and original task.
@@ -105,6 +433,26 @@ def update_plan(plan,original_prompt,webname="default",reasoning_steps=None,page
     Raises:
         None
     """
+    return prompt_cascade(updater_cascade, update_plan_request(plan, original_prompt, webname, reasoning_steps, page_summary), plan_trigger)
+
+
+async def update_plan_async(plan,original_prompt,webname="default",reasoning_steps=None,page_summary="No website shown"):
+    """
+    Async version of update_plan.
+
+    Returns:
+        str: The response from the chatbot after updating the planner instructions.
+    """
+    return await prompt_cascade_async(updater_cascade, update_plan_request(plan, original_prompt, webname, reasoning_steps, page_summary), plan_trigger)
+
+
+def update_plan_request(plan,original_prompt,webname="default",reasoning_steps=None,page_summary="No website shown"):
+    """
+    Build the prompts, system prompt and model name for the plan updater.
+
+    Returns:
+        tuple: The prompts, system prompt and model name to pass to prompt_groq.
+    """
 
     update_prompt = f'''You are a self operating web browser.
     Your task is to revise a list of intructions to complete based on the last plan, the current webpage layout, the reasoning steps before and the Original Task.
@@ -147,15 +495,21 @@ def update_plan(plan,original_prompt,webname="default",reasoning_steps=None,page
         for reason_step in reasoning_steps
     ]
     prompts.append({"role": "user", "content": plan})
-    return prompt_groq(prompts, update_prompt,modelName="llama3-70b-8192")
+    return prompts, update_prompt, Settings.Planner_Models[-1]
 
-def create_commands(prompt,webname):
+def create_commands(prompt,webname,metrics=None,count=1,model=None,history=None):
     """
     Create commands based on a given prompt and website name to interact with elements in an accessibility tree.
 
+    With Settings.UseCommandStreaming the response is streamed and cut off as soon as its commands are complete.
+
     Args:
         prompt (str): The prompt to generate commands for.
         webname (str): Name of the website being interacted with.
+        metrics (dict): Streaming timings are added to it(default is None).
+        count (int): The max number of commands, more than one when the prompt lists next instructions(default is 1).
+        model (str): The model to ask, the driver picks it from the command cascade with Settings.UseModelCascade(default is the first of Settings.Command_Models).
+        history (list): The messages before the prompt in a tree delta conversation(the full tree), None to send the prompt on its own.
 
     Returns:
         str: The response from the chatbot after generating the commands.
@@ -163,8 +517,39 @@ def create_commands(prompt,webname):
     Raises:
         None
     """
-    return prompt_groq(
-        [{"role": "user", "content": prompt}],
+    if Settings.UseCommandStreaming:
+        return prompt_groq_stream(*commands_request(prompt, webname, count, model, history), stop_when=commands_complete(count), metrics=metrics)
+    return prompt_groq(*commands_request(prompt, webname, count, model, history))
+
+
+async def create_commands_async(prompt,webname,metrics=None,count=1,model=None,history=None):
+    """
+    Async version of create_commands.
+
+    Returns:
+        str: The response from the chatbot after generating the commands.
+    """
+    if Settings.UseCommandStreaming:
+        return await prompt_groq_stream_async(*commands_request(prompt, webname, count, model, history), stop_when=commands_complete(count), metrics=metrics)
+    return await prompt_groq_async(*commands_request(prompt, webname, count, model, history))
+
+
+def commands_request(prompt,webname,count=1,model=None,history=None):
+    """
+    Build the prompts, system prompt and model name for the command agent.
+
+    Args:
+        prompt (str): The prompt to generate commands for.
+        webname (str): Name of the website being interacted with.
+        count (int): The max number of commands, the batching rules are added to the system prompt when it is more than one.
+        model (str): The model to ask(default is the first of Settings.Command_Models).
+        history (list): The messages before the prompt in a tree delta conversation, the delta rules are added to the system prompt when it is given.
+
+    Returns:
+        tuple: The prompts, system prompt and model name to pass to prompt_groq.
+    """
+    return (
+        (history or []) + [{"role": "user", "content": prompt}],
         f'''This is an accessibility tree, it has elements with their index, name and role.
         Your task is to form a thought about the instruction and create a single command based on the single intruction you were given
         if you want to click something output 'Click(index)' it takes one parameter the index of the element
@@ -191,7 +576,9 @@ def create_commands(prompt,webname):
         Command:
         Input(22,Burger)
 
-        if you are asked to scroll down type 'Scroll()' Also do this if you dont see the node being referred to
+        if you are asked to scroll down type 'Scroll()'
+        If you dont see the node being referred to type 'Find(words describing the node)' it searches every node on the page
+        The closest matches are then shown to you under Find results: pick the node from them if one matches, otherwise type 'Scroll()'
         If you are asked to press enter type 'Enter()'
         If you are asked to go to a website type 'Navigate(desired_url)' it takes one parameter which is the url
 
@@ -228,5 +615,36 @@ def create_commands(prompt,webname):
         Your command should only be a single command to execute with no commentary as concise as possible
         Current Site is: {webname}
         Write your thought and command to execute now
-        ''',
+        ''' + (BATCH_PROMPT if count > 1 else "") + (DELTA_PROMPT if history is not None else ""),
+        model or Settings.Command_Models[0],
     )
+
+
+#Added to the command agent's system prompt in a tree delta conversation
+DELTA_PROMPT = '''
+        The accessibility tree is sent in full before the instruction, later on the same page it is followed by the changes to it since it was sent
+        Every node that is not listed in the changes is still there as shown in the tree
+        + is a node that was added, - a node that was removed and ~ a node whose line changed(old -> new)
+        '''
+
+#Added to the command agent's system prompt when the next instructions are listed
+BATCH_PROMPT = '''
+        You may also be given the Next instructions that follow the instruction.
+        For each next instruction in order that is an Input, Click, Enter or Read you can already do on this accessibility tree, add one more command on its own line with the exact title Command:
+        Stop adding commands at the first next instruction you can not do on this tree, for example because the page has to change first
+        The first command is always for the instruction itself
+
+        Command Example:
+        22 combobox Search
+        875 link More options
+        Instruction:
+        Input Burger into the search bar
+        Next instructions:
+        Press enter
+        Click the first result
+        Thought:
+        22 combobox Search is the search bar so I will input Burger into it. Pressing enter needs no element so I can add it.
+        The results are not on the page yet so I can not click the first result and stop there.
+        Command: Input(22,Burger)
+        Command: Enter()
+        '''
@@ -0,0 +1,441 @@
+from typing import Final
+
+from collections import deque
+from dotenv import load_dotenv
+import asyncio
+import contextlib
+import inspect
+import math
+import os
+import random
+import re
+import threading
+import time
+import weakref
+import groq
+import httpx
+import openai
+import Settings
+import Tracing
+
+
+load_dotenv()
+GROQKEY: Final[str] = os.getenv('GROQ_APIKEY')
+
+#Durations in rate limit headers, e.g. 2m59.56s, 7.66s or 500ms
+DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+DURATION_SECONDS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+#Seconds of a rate limit header duration, plain numbers are seconds
+def parse_duration(value):
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = DURATION_PART.findall(value)
+    return sum(float(amount) * DURATION_SECONDS[unit] for amount, unit in parts) if parts else None
+
+#Token usage sent with a streamed chunk, Groq puts it under x_groq in the last one
+def chunk_usage(chunk):
+    usage = getattr(chunk, "usage", None)
+    x_groq = getattr(chunk, "x_groq", None)
+    if usage is None and x_groq is not None:
+        usage = x_groq.get("usage") if isinstance(x_groq, dict) else getattr(x_groq, "usage", None)
+    return usage
+
+#Prompt and completion tokens of a usage object or dict, zeros when unknown
+def usage_tokens(usage):
+    if usage is None:
+        return 0, 0
+    if isinstance(usage, dict):
+        return usage.get("prompt_tokens") or 0, usage.get("completion_tokens") or 0
+    return usage.prompt_tokens or 0, usage.completion_tokens or 0
+
+#Token usage of a call on its trace span
+def trace_usage(span,usage):
+    prompt_tokens, completion_tokens = usage_tokens(usage)
+    span.set(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+#Rough token count of a request, used to spend the token budget before the real usage is known
+def estimate_request_tokens(request):
+    chars = 0
+    for message in request["messages"]:
+        content = message["content"]
+        if isinstance(content, str):
+            chars += len(content)
+        else:
+            chars += sum(len(part.get("text", "")) for part in content)
+    return chars // 4 + 1
+
+
+class TokenBucket:
+    """
+    Budget that refills at a steady rate, kept in step with the limit/remaining/reset values of rate limit headers.
+
+    The bucket is unlimited until the first headers arrive, so providers that send none(LM Studio) are never throttled.
+
+    Functions:
+    - sync(limit, remaining, reset): Reset the budget from response headers.
+    - block(seconds): Allow nothing until the given seconds have passed(after a 429).
+    - delay(amount): Seconds until the amount can be taken.
+    - take(amount): Spend the amount.
+    """
+
+    def __init__(self):
+        self.capacity = None
+        self.level = 0.0
+        self.rate = 0.0
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def refill(self):
+        now = time.monotonic()
+        if self.capacity is not None:
+            self.level = min(self.capacity, self.level + self.rate * (now - self.updated))
+        self.updated = now
+        return now
+
+    def sync(self,limit,remaining,reset):
+        if limit is None or remaining is None:
+            return
+        self.refill()
+        self.capacity = float(limit)
+        self.level = float(remaining)
+        if reset and limit > remaining:
+            #Refills to full by the reset time
+            self.rate = (limit - remaining) / reset
+        elif self.rate == 0:
+            self.rate = float(limit)
+
+    def block(self,seconds):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.level = 0.0
+
+    def delay(self,amount):
+        now = self.refill()
+        blocked = max(0.0, self.blocked_until - now)
+        if self.capacity is None:
+            return blocked
+        missing = min(amount, self.capacity) - self.level
+        if missing <= 0:
+            return blocked
+        return max(blocked, missing / self.rate if self.rate else 1.0)
+
+    def take(self,amount):
+        if self.capacity is not None:
+            self.level -= min(amount, self.capacity)
+
+
+class CallStats:
+    """
+    Latency and token counters of the calls made to one provider.
+
+    Functions:
+    - record(latency, usage): Add a finished call.
+    - summary(): Return the counters with the mean and 95th percentile latency.
+    """
+
+    def __init__(self,window=1000):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.total_latency = 0.0
+        self.latencies = deque(maxlen=window)
+
+    def record(self,latency,usage=None):
+        self.calls += 1
+        self.total_latency += latency
+        self.latencies.append(latency)
+        prompt_tokens, completion_tokens = usage_tokens(usage)
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "mean_latency": round(self.total_latency / self.calls, 3) if self.calls else None,
+            "p95_latency": round(latencies[math.ceil(len(latencies) * 0.95) - 1], 3) if latencies else None,
+        }
+
+
+class Provider:
+    """
+    Pooled client of one OpenAI compatible provider with concurrency limits, rate limiting and retries.
+
+    Every call waits for a concurrency slot and for the request and token budgets learnt from the
+    provider's rate limit headers, then retries 429s, 5xx responses and connection errors with jittered
+    exponential backoff. Connections are kept alive and reused between calls.
+
+    Functions:
+    - complete(request): Send a chat completion request and return the completion.
+    - complete_async(request): Async version of complete.
+    - stream(request): Context manager yielding the chunks of a streamed completion.
+    - stream_async(request): Async version of stream.
+    """
+
+    def __init__(self,name,client_class,async_client_class,base_url,api_key,max_concurrent):
+        self.name = name
+        self.client_class = client_class
+        self.async_client_class = async_client_class
+        self.base_url = base_url
+        self.api_key = api_key
+        self.max_concurrent = max_concurrent
+        self.requests = TokenBucket()
+        self.tokens = TokenBucket()
+        self.stats = CallStats()
+        self.lock = threading.Lock()
+        self.limiter = threading.BoundedSemaphore(max_concurrent)
+        #asyncio semaphores belong to one event loop
+        self.async_limiters = weakref.WeakKeyDictionary()
+        self._client = None
+        self._async_client = None
+
+    def limits(self):
+        return httpx.Limits(
+            max_connections=self.max_concurrent * 2,
+            max_keepalive_connections=self.max_concurrent,
+            keepalive_expiry=Settings.LLM_Keepalive,
+        )
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = self.client_class(
+                base_url=self.base_url,
+                api_key=self.api_key,
+                timeout=Settings.LLM_Timeout,
+                max_retries=0,
+                http_client=httpx.Client(limits=self.limits(), timeout=Settings.LLM_Timeout),
+            )
+        return self._client
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            self._async_client = self.async_client_class(
+                base_url=self.base_url,
+                api_key=self.api_key,
+                timeout=Settings.LLM_Timeout,
+                max_retries=0,
+                http_client=httpx.AsyncClient(limits=self.limits(), timeout=Settings.LLM_Timeout),
+            )
+        return self._async_client
+
+    def async_limiter(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self.async_limiters:
+            self.async_limiters[loop] = asyncio.Semaphore(self.max_concurrent)
+        return self.async_limiters[loop]
+
+    #Seconds to wait before the request fits the budgets, the budgets are spent when it is 0
+    def reserve(self,tokens):
+        with self.lock:
+            delay = max(self.requests.delay(1), self.tokens.delay(tokens))
+            if delay == 0:
+                self.requests.take(1)
+                self.tokens.take(tokens)
+            return delay
+
+    def update_limits(self,headers):
+        with self.lock:
+            self.requests.sync(
+                parse_duration(headers.get("x-ratelimit-limit-requests")),
+                parse_duration(headers.get("x-ratelimit-remaining-requests")),
+                parse_duration(headers.get("x-ratelimit-reset-requests")),
+            )
+            self.tokens.sync(
+                parse_duration(headers.get("x-ratelimit-limit-tokens")),
+                parse_duration(headers.get("x-ratelimit-remaining-tokens")),
+                parse_duration(headers.get("x-ratelimit-reset-tokens")),
+            )
+
+    def retry_delay(self,error,attempt):
+        """
+        Return the seconds to wait before retrying a failed call, or None when it should not be retried.
+
+        Args:
+            error (Exception): The error raised by the call.
+            attempt (int): The number of retries so far.
+
+        Returns:
+            float: The seconds to wait, None to give up.
+        """
+        if attempt >= Settings.LLM_Max_Retries:
+            return None
+        backoff = random.uniform(0, min(Settings.LLM_Backoff_Max, Settings.LLM_Backoff_Base * 2 ** attempt))
+        if isinstance(error, (groq.APIConnectionError, openai.APIConnectionError)):
+            return backoff
+        if not isinstance(error, (groq.APIStatusError, openai.APIStatusError)):
+            return None
+        if error.status_code == 429:
+            self.stats.rate_limited += 1
+            retry_after = parse_duration(error.response.headers.get("retry-after"))
+            if retry_after is not None:
+                with self.lock:
+                    self.requests.block(retry_after)
+                return retry_after + backoff * 0.1
+            return backoff
+        if error.status_code >= 500:
+            return backoff
+        return None
+
+    def call(self,create,request):
+        tokens = estimate_request_tokens(request)
+        attempt = 0
+        while True:
+            delay = self.reserve(tokens)
+            if delay > 0:
+                time.sleep(delay)
+                continue
+            try:
+                response = create(**request)
+            except Exception as e:
+                delay = self.retry_delay(e, attempt)
+                if delay is None:
+                    self.stats.errors += 1
+                    raise
+                self.stats.retries += 1
+                attempt += 1
+                time.sleep(delay)
+                continue
+            self.update_limits(response.headers)
+            return response.parse()
+
+    async def call_async(self,create,request):
+        tokens = estimate_request_tokens(request)
+        attempt = 0
+        while True:
+            delay = self.reserve(tokens)
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            try:
+                response = await create(**request)
+            except Exception as e:
+                delay = self.retry_delay(e, attempt)
+                if delay is None:
+                    self.stats.errors += 1
+                    raise
+                self.stats.retries += 1
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            self.update_limits(response.headers)
+            parsed = response.parse()
+            return await parsed if inspect.isawaitable(parsed) else parsed
+
+    def complete(self,request):
+        """
+        Send a chat completion request.
+
+        Args:
+            request (dict): The keyword arguments for chat.completions.create.
+
+        Returns:
+            ChatCompletion: The completion.
+        """
+        with self.limiter, Tracing.span("llm", provider=self.name, model=request["model"]) as span:
+            start = time.perf_counter()
+            completion = self.call(self.client.chat.completions.with_raw_response.create, request)
+            self.stats.record(time.perf_counter() - start, completion.usage)
+            trace_usage(span, completion.usage)
+            return completion
+
+    async def complete_async(self,request):
+        """
+        Async version of complete.
+
+        Returns:
+            ChatCompletion: The completion.
+        """
+        async with self.async_limiter():
+            with Tracing.span("llm", provider=self.name, model=request["model"]) as span:
+                start = time.perf_counter()
+                completion = await self.call_async(self.async_client.chat.completions.with_raw_response.create, request)
+                self.stats.record(time.perf_counter() - start, completion.usage)
+                trace_usage(span, completion.usage)
+                return completion
+
+    @contextlib.contextmanager
+    def stream(self,request):
+        """
+        Send a streamed chat completion request, only the request itself is retried.
+
+        Leaving the block closes the stream, which cancels the rest of the generation.
+
+        Args:
+            request (dict): The keyword arguments for chat.completions.create with stream=True.
+
+        Yields:
+            generator: The chunks of the completion.
+        """
+        with self.limiter, Tracing.span("llm", provider=self.name, model=request["model"], stream=True) as span:
+            start = time.perf_counter()
+            stream = self.call(self.client.chat.completions.with_raw_response.create, request)
+            usage = []
+
+            def chunks():
+                for chunk in stream:
+                    usage.append(chunk_usage(chunk))
+                    yield chunk
+            try:
+                yield chunks()
+            finally:
+                stream.close()
+                final_usage = next((u for u in reversed(usage) if u is not None), None)
+                self.stats.record(time.perf_counter() - start, final_usage)
+                trace_usage(span, final_usage)
+
+    @contextlib.asynccontextmanager
+    async def stream_async(self,request):
+        """
+        Async version of stream.
+
+        Yields:
+            async generator: The chunks of the completion.
+        """
+        async with self.async_limiter():
+            with Tracing.span("llm", provider=self.name, model=request["model"], stream=True) as span:
+                start = time.perf_counter()
+                stream = await self.call_async(self.async_client.chat.completions.with_raw_response.create, request)
+                usage = []
+
+                async def chunks():
+                    async for chunk in stream:
+                        usage.append(chunk_usage(chunk))
+                        yield chunk
+                try:
+                    yield chunks()
+                finally:
+                    await stream.close()
+                    final_usage = next((u for u in reversed(usage) if u is not None), None)
+                    self.stats.record(time.perf_counter() - start, final_usage)
+                    trace_usage(span, final_usage)
+
+
+#Planner, updater and command agent
+groq_provider = Provider("groq", groq.Groq, groq.AsyncGroq, Settings.Groq_Base_URL, GROQKEY, Settings.Max_Concurrent_LLM)
+#Local vision model served by LM Studio
+vision_provider = Provider("vision", openai.OpenAI, openai.AsyncOpenAI, Settings.Vision_Base_URL, "lm-studio", Settings.Vision_Max_Concurrent)
+
+
+def stats():
+    """
+    Return the call counters of every provider.
+
+    Returns:
+        dict: Provider name to its calls, errors, retries, rate limited calls, tokens and latency.
+    """
+    return {provider.name: provider.stats.summary() for provider in (groq_provider, vision_provider)}
@@ -0,0 +1,88 @@
+import time
+import Tracing
+
+
+class ModelCascade:
+    """
+    Routes the requests of one agent through a list of models from the cheapest up.
+
+    Each answer is checked, and only an answer that trips a trigger(it could not be parsed, names a node
+    that is not there...) is asked again from the next model. The answer of the last model is always used.
+    The requests, accepted answers, triggers and seconds of every tier are counted.
+
+    Functions:
+    - run(ask, check, start): Ask the models from tier start up until check accepts an answer.
+    - run_async(ask, check, start): Async version of run.
+    - stats(): Return the counters of every tier.
+    """
+
+    def __init__(self,name,models):
+        self.name = name
+        self.models = models
+        self.tiers = [{"requests": 0, "accepted": 0, "triggers": {}, "seconds": 0.0} for _ in models]
+
+    def run(self,ask,check,start=0):
+        """
+        Ask the models from tier start up until an answer passes the check.
+
+        Args:
+            ask (function): Called with a model name, returns its answer.
+            check (function): Called with an answer, returns the trigger that escalates it or None to accept it.
+            start (int): The first tier asked(default is 0).
+
+        Returns:
+            tuple: The answer and the tier that gave it.
+        """
+        for tier in range(start, len(self.models)):
+            begin = time.perf_counter()
+            answer = ask(self.models[tier])
+            if self.accept(tier, begin, check(answer)):
+                return answer, tier
+        return answer, tier
+
+    async def run_async(self,ask,check,start=0):
+        """
+        Async version of run, ask returns an awaitable.
+
+        Returns:
+            tuple: The answer and the tier that gave it.
+        """
+        for tier in range(start, len(self.models)):
+            begin = time.perf_counter()
+            answer = await ask(self.models[tier])
+            if self.accept(tier, begin, check(answer)):
+                return answer, tier
+        return answer, tier
+
+    #Counts an answer and returns whether it is used, the last tier's answer always is
+    def accept(self,tier,begin,trigger):
+        counters = self.tiers[tier]
+        counters["requests"] += 1
+        counters["seconds"] += time.perf_counter() - begin
+        Tracing.record("cascade", begin, cascade=self.name, model=self.models[tier], tier=tier, trigger=trigger)
+        if trigger is None:
+            counters["accepted"] += 1
+            return True
+        counters["triggers"][trigger] = counters["triggers"].get(trigger, 0) + 1
+        if tier + 1 < len(self.models):
+            print(f"Escalating {self.name} from {self.models[tier]} to {self.models[tier + 1]}: {trigger}")
+            return False
+        return True
+
+    def stats(self):
+        """
+        Return the counters of every tier.
+
+        Returns:
+            list: Per tier the model, requests, the share of accepted answers, the triggers and the mean seconds.
+        """
+        return [
+            {
+                "model": model,
+                "requests": counters["requests"],
+                "accept_rate": round(counters["accepted"] / counters["requests"], 3) if counters["requests"] else None,
+                "triggers": dict(counters["triggers"]),
+                "mean_seconds": round(counters["seconds"] / counters["requests"], 3) if counters["requests"] else None,
+            }
+            for model, counters in zip(self.models, self.tiers)
+        ]
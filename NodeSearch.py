@@ -0,0 +1,90 @@
+from collections import Counter, defaultdict
+import heapq
+import math
+import re
+
+
+#Lowercase word tokens of a piece of text
+def tokenize(text):
+    return re.findall(r"\w+", text.lower())
+
+#Character trigrams of a term padded so short terms still get some
+def trigrams(term):
+    padded = f"  {term} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NodeSearchIndex:
+    """
+    Inverted index over the names and roles of accessibility nodes ranked with BM25.
+
+    Query terms are matched against indexed terms by trigram similarity, so partial
+    words and small typos still find a node("serch" finds "search").
+
+    Functions:
+    - search(query, k): Return the k best matching nodes with their scores.
+    """
+
+    def __init__(self, nodes, k1=1.2, b=0.75, min_similarity=0.4):
+        self.k1 = k1
+        self.b = b
+        self.min_similarity = min_similarity
+        self.nodes = []
+        self.lengths = []
+        self.postings = defaultdict(dict)
+        self.term_trigrams = {}
+        self.trigram_terms = defaultdict(set)
+        for node in nodes:
+            name = node.name or ""
+            role = node.role or ""
+            terms = tokenize(name) + tokenize(role)
+            if not terms:
+                continue
+            doc = len(self.nodes)
+            self.nodes.append(node)
+            self.lengths.append(len(terms))
+            for term, count in Counter(terms).items():
+                self.postings[term][doc] = count
+        for term in self.postings:
+            self.term_trigrams[term] = trigrams(term)
+            for trigram in self.term_trigrams[term]:
+                self.trigram_terms[trigram].add(term)
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0
+
+    #Indexed terms similar to a query term with their trigram similarity(Jaccard)
+    def similar_terms(self, term):
+        if term in self.postings:
+            return {term: 1.0}
+        query_trigrams = trigrams(term)
+        shared = Counter()
+        for trigram in query_trigrams:
+            shared.update(self.trigram_terms.get(trigram, ()))
+        similar = {}
+        for candidate, count in shared.items():
+            similarity = count / (len(query_trigrams) + len(self.term_trigrams[candidate]) - count)
+            if similarity >= self.min_similarity:
+                similar[candidate] = similarity
+        return similar
+
+    def search(self, query, k=10):
+        """
+        Return the nodes that best match a query.
+
+        Args:
+            query (str): Words describing the node.
+            k (int): The max number of nodes to return.
+
+        Returns:
+            list: (score, node) pairs, best match first.
+        """
+        scores = defaultdict(float)
+        total = len(self.nodes)
+        for query_term in set(tokenize(query)):
+            for term, similarity in self.similar_terms(query_term).items():
+                postings = self.postings[term]
+                idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc, count in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.lengths[doc] / self.average_length)
+                    scores[doc] += similarity * idf * count * (self.k1 + 1) / (count + norm)
+        best = heapq.nlargest(k, scores.items(), key=lambda item: (item[1], -item[0]))
+        return [(score, self.nodes[doc]) for doc, score in best]
@@ -0,0 +1,37 @@
+#DOMSnapshot.captureSnapshot parameters, only the layout boxes are needed so no computed styles are requested
+SNAPSHOT_PARAMS = {"computedStyles": []}
+
+
+def node_boxes(snapshot):
+    """
+    Read the vertical extent of every laid out node of the main document from a DOMSnapshot.
+
+    A node split over several layout objects(e.g. wrapped text) gets the union of their boxes.
+    Nodes without a layout object(display: none, display: contents) and nodes of iframes are left out.
+
+    Args:
+        snapshot (dict): The DOMSnapshot.captureSnapshot response.
+
+    Returns:
+        dict: backendNodeId to the (top, bottom) of its box in CSS pixels from the top of the document.
+    """
+    document = snapshot["documents"][0]
+    backend_ids = document["nodes"]["backendNodeId"]
+    layout = document["layout"]
+    boxes = {}
+    for node_index, (x, y, width, height) in zip(layout["nodeIndex"], layout["bounds"]):
+        backend_id = backend_ids[node_index]
+        top, bottom = boxes.get(backend_id, (y, y + height))
+        boxes[backend_id] = (min(top, y), max(bottom, y + height))
+    return boxes
+
+
+#The scroll position and height of the viewport and the height of the page from Page.getLayoutMetrics
+def viewport(metrics):
+    layout_viewport = metrics.get("cssLayoutViewport") or metrics["layoutViewport"]
+    content = metrics.get("cssContentSize") or metrics["contentSize"]
+    return layout_viewport["pageY"], layout_viewport["clientHeight"], content["height"]
+
+#Whether a (top, bottom) box overlaps the viewport, a box ending on its top edge belongs to the screen above
+def in_view(box,top,height):
+    return box[0] < top + height and (box[1] > top or box[0] >= top)
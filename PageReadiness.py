@@ -0,0 +1,214 @@
+from playwright.sync_api import Error as PlaywrightError
+import asyncio
+import time
+import Settings
+
+
+#Resolves once the DOM had no mutations for quietMs, or after timeoutMs, with the time waited in ms
+DOM_QUIET_SCRIPT = """([quietMs, timeoutMs]) => new Promise(resolve => {
+    const start = performance.now();
+    let finished = false;
+    let quietTimer = null;
+    const finish = () => {
+        if (finished) return;
+        finished = true;
+        observer.disconnect();
+        clearTimeout(quietTimer);
+        clearTimeout(deadline);
+        resolve(performance.now() - start);
+    };
+    const observer = new MutationObserver(() => {
+        clearTimeout(quietTimer);
+        quietTimer = setTimeout(finish, quietMs);
+    });
+    const deadline = setTimeout(finish, timeoutMs);
+    observer.observe(document, {subtree: true, childList: true, attributes: true, characterData: true});
+    quietTimer = setTimeout(finish, quietMs);
+})"""
+
+
+#A cheap fingerprint of the accessibility tree used to tell if it is still changing
+def ax_fingerprint(nodes):
+    return hash(tuple((node.get("backendDOMNodeId"), node.get("name", {}).get("value")) for node in nodes))
+
+
+#Whether the deadline of a wait has not passed yet
+#Every time check of a wait goes through here, so a session replay can serve the recorded outcomes instead of its own clock
+def before_deadline(deadline):
+    return time.perf_counter() < deadline
+
+
+#Whether an error means the document was replaced while it was waited on
+def navigation_error(error):
+    message = str(error).lower()
+    return "context was destroyed" in message or "navigat" in message
+
+
+class NavigationWatch:
+    """
+    Counts the navigations of the main frame while the page is waited on.
+
+    The events arrive between the calls made on the page, so whether a navigation was seen is only decided in seen,
+    which a session replay answers from the recording.
+
+    Functions:
+    - seen(count): Whether the page navigated since count navigations were seen.
+    - close(): Stop listening.
+    """
+
+    def __init__(self,page):
+        self.page = page
+        self.count = 0
+        page.on("framenavigated", self.on_navigated)
+
+    #The frame is checked on its own, the page may be a recording proxy that must not be used from an event
+    def on_navigated(self,frame):
+        if frame.parent_frame is None:
+            self.count += 1
+
+    def seen(self,count):
+        return self.count > count
+
+    def close(self):
+        self.page.remove_listener("framenavigated", self.on_navigated)
+
+
+def wait_until_ready(page, client, timeout=None, label="command"):
+    """
+    Wait until the page is ready based on the signals in Settings.Ready_Signals instead of a fixed sleep.
+
+    Signals:
+    - load: the load event fired.
+    - networkidle: no network connections for 500ms(capped by Settings.Network_Idle_Timeout).
+    - dom: no DOM mutations for Settings.Dom_Quiet_Ms.
+    - ax: the accessibility tree was the same across two polls Settings.Ax_Poll_Ms apart.
+
+    A command that navigates may only replace the document after the first signals returned for the old one.
+    When the page navigates while a signal is waited on, the new document is waited on until it loaded
+    and every signal is waited for again on it.
+
+    Args:
+        page (Page): The playwright page.
+        client (CDPSession): The CDP session of the page.
+        timeout (float): The max seconds to wait for all signals together(default is Settings.Ready_Timeout).
+        label (str): What is being waited for, used in the log.
+
+    Returns:
+        float: The seconds actually waited.
+    """
+    if timeout is None:
+        timeout = Settings.Ready_Timeout
+    start = time.perf_counter()
+    deadline = start + timeout
+    reached = []
+    watch = NavigationWatch(page)
+    try:
+        index = 0
+        while index < len(Settings.Ready_Signals) and before_deadline(deadline):
+            signal = Settings.Ready_Signals[index]
+            navigations = watch.count
+            try:
+                ready = wait_for_signal(page, client, signal, deadline)
+            except PlaywrightError as e:
+                #Timed out, or the document was replaced under the signal
+                ready = False
+                if navigation_error(e):
+                    watch.count += 1
+            if watch.seen(navigations):
+                reached.clear()
+                index = 0
+                for state in ("domcontentloaded", "load"):
+                    try:
+                        page.wait_for_load_state(state, timeout=max(deadline - time.perf_counter(), 0.001) * 1000)
+                    except PlaywrightError:
+                        break
+                continue
+            if ready:
+                reached.append(signal)
+            index += 1
+    finally:
+        watch.close()
+    elapsed = time.perf_counter() - start
+    print(f"Page ready after {elapsed:.2f}s ({label}: {', '.join(reached) or 'timed out'})")
+    return elapsed
+
+
+#Wait for one readiness signal until the deadline, returns whether it was reached
+def wait_for_signal(page, client, signal, deadline):
+    remaining = deadline - time.perf_counter()
+    if signal == "load":
+        page.wait_for_load_state("load", timeout=remaining * 1000)
+    elif signal == "networkidle":
+        page.wait_for_load_state("networkidle", timeout=min(remaining, Settings.Network_Idle_Timeout) * 1000)
+    elif signal == "dom":
+        page.evaluate(DOM_QUIET_SCRIPT, [Settings.Dom_Quiet_Ms, remaining * 1000])
+    elif signal == "ax":
+        last = None
+        current = ax_fingerprint(client.send("Accessibility.getFullAXTree")["nodes"])
+        while current != last and before_deadline(deadline):
+            time.sleep(Settings.Ax_Poll_Ms / 1000)
+            last, current = current, ax_fingerprint(client.send("Accessibility.getFullAXTree")["nodes"])
+        return current == last
+    return True
+
+
+async def wait_until_ready_async(page, client, timeout=None, label="command"):
+    """
+    Async version of wait_until_ready.
+
+    Returns:
+        float: The seconds actually waited.
+    """
+    if timeout is None:
+        timeout = Settings.Ready_Timeout
+    start = time.perf_counter()
+    deadline = start + timeout
+    reached = []
+    watch = NavigationWatch(page)
+    try:
+        index = 0
+        while index < len(Settings.Ready_Signals) and before_deadline(deadline):
+            signal = Settings.Ready_Signals[index]
+            navigations = watch.count
+            try:
+                ready = await wait_for_signal_async(page, client, signal, deadline)
+            except PlaywrightError as e:
+                ready = False
+                if navigation_error(e):
+                    watch.count += 1
+            if watch.seen(navigations):
+                reached.clear()
+                index = 0
+                for state in ("domcontentloaded", "load"):
+                    try:
+                        await page.wait_for_load_state(state, timeout=max(deadline - time.perf_counter(), 0.001) * 1000)
+                    except PlaywrightError:
+                        break
+                continue
+            if ready:
+                reached.append(signal)
+            index += 1
+    finally:
+        watch.close()
+    elapsed = time.perf_counter() - start
+    print(f"Page ready after {elapsed:.2f}s ({label}: {', '.join(reached) or 'timed out'})")
+    return elapsed
+
+
+#Async version of wait_for_signal
+async def wait_for_signal_async(page, client, signal, deadline):
+    remaining = deadline - time.perf_counter()
+    if signal == "load":
+        await page.wait_for_load_state("load", timeout=remaining * 1000)
+    elif signal == "networkidle":
+        await page.wait_for_load_state("networkidle", timeout=min(remaining, Settings.Network_Idle_Timeout) * 1000)
+    elif signal == "dom":
+        await page.evaluate(DOM_QUIET_SCRIPT, [Settings.Dom_Quiet_Ms, remaining * 1000])
+    elif signal == "ax":
+        last = None
+        current = ax_fingerprint((await client.send("Accessibility.getFullAXTree"))["nodes"])
+        while current != last and before_deadline(deadline):
+            await asyncio.sleep(Settings.Ax_Poll_Ms / 1000)
+            last, current = current, ax_fingerprint((await client.send("Accessibility.getFullAXTree"))["nodes"])
+        return current == last
+    return True
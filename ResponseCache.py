@@ -0,0 +1,109 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+class ResponseCache:
+    """
+    Content addressed cache of LLM responses stored in SQLite.
+
+    Entries are keyed on a hash of the full request (model, messages and sampling parameters)
+    and evicted when they are older than max_age or when the cache grows past max_bytes,
+    least recently used first.
+
+    Functions:
+    - make_key(request): Hash a request into a cache key.
+    - get(key): Return the cached response or None.
+    - put(key, response): Store a response and evict old entries.
+    - stats(): Return the hit/miss counters and the size of the cache.
+    """
+
+    def __init__(self, path, max_bytes, max_age):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT, size INTEGER, created REAL, accessed REAL)"
+        )
+        self.connection.commit()
+
+    @staticmethod
+    def make_key(request):
+        """
+        Hash a request into a cache key.
+
+        Args:
+            request (dict): The JSON serializable request sent to the LLM.
+
+        Returns:
+            str: The hex digest of the request.
+        """
+        return hashlib.sha256(json.dumps(request, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        Return the cached response for a key, counting a hit or a miss.
+
+        Args:
+            key (str): The cache key from make_key.
+
+        Returns:
+            str: The cached response or None if it is missing or expired.
+        """
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.max_age:
+                self.misses += 1
+                return None
+            self.connection.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.connection.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, response):
+        """
+        Store a response and evict expired or least recently used entries.
+
+        Args:
+            key (str): The cache key from make_key.
+            response (str): The response to store.
+        """
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, response, len(response.encode("utf-8")), now, now),
+            )
+            self.evict(now)
+            self.connection.commit()
+
+    def evict(self, now):
+        self.connection.execute("DELETE FROM responses WHERE created < ?", (now - self.max_age,))
+        total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        expired = []
+        for key, size in self.connection.execute("SELECT key, size FROM responses ORDER BY accessed"):
+            if total <= self.max_bytes:
+                break
+            expired.append((key,))
+            total -= size
+        self.connection.executemany("DELETE FROM responses WHERE key = ?", expired)
+
+    def stats(self):
+        """
+        Return the hit/miss counters and the size of the cache.
+
+        Returns:
+            dict: hits, misses, entries and bytes.
+        """
+        with self.lock:
+            entries, size = self.connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": size}
@@ -0,0 +1,218 @@
+from collections import OrderedDict
+import base64
+import struct
+import threading
+import zlib
+import Settings
+
+
+#Width of the grayscale thumbnail hashed by dhash, the hash compares each pixel to its right neighbour
+HASH_WIDTH = 9
+HASH_HEIGHT = 8
+#Width of the PNG thumbnail captured for the hash, large enough to average out antialiasing
+THUMBNAIL_WIDTH = 64
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+#Channels per pixel of each 8 bit PNG color type
+PNG_CHANNELS = {0: 1, 2: 3, 4: 2, 6: 4}
+
+
+#Page.captureScreenshot parameters for the visible viewport scaled to a width
+def screenshot_params(metrics,width,image_format,quality=None):
+    viewport = metrics.get("cssVisualViewport") or metrics["visualViewport"]
+    clip = {
+        "x": viewport["pageX"],
+        "y": viewport["pageY"],
+        "width": viewport["clientWidth"],
+        "height": viewport["clientHeight"],
+        "scale": min(1.0, width / viewport["clientWidth"]),
+    }
+    params = {"format": image_format, "clip": clip}
+    if quality is not None:
+        params["quality"] = quality
+    return params
+
+
+def capture(client):
+    """
+    Capture the viewport in memory as a downscaled JPEG, together with its perceptual hash.
+
+    Args:
+        client (CDPSession): The CDP session of the page.
+
+    Returns:
+        tuple: The JPEG bytes and the 64 bit dhash of the viewport.
+    """
+    metrics = client.send("Page.getLayoutMetrics")
+    return capture_image(client, metrics), capture_hash(client, metrics)
+
+
+async def capture_async(client):
+    """
+    Async version of capture.
+
+    Returns:
+        tuple: The JPEG bytes and the 64 bit dhash of the viewport.
+    """
+    metrics = await client.send("Page.getLayoutMetrics")
+    return await capture_image_async(client, metrics), await capture_hash_async(client, metrics)
+
+
+#The viewport as a JPEG scaled to Settings.Screenshot_Max_Width
+def capture_image(client,metrics):
+    image = client.send("Page.captureScreenshot", screenshot_params(metrics, Settings.Screenshot_Max_Width, "jpeg", Settings.Screenshot_Quality))
+    return base64.b64decode(image["data"])
+
+async def capture_image_async(client,metrics):
+    image = await client.send("Page.captureScreenshot", screenshot_params(metrics, Settings.Screenshot_Max_Width, "jpeg", Settings.Screenshot_Quality))
+    return base64.b64decode(image["data"])
+
+#The dhash of a small PNG thumbnail of the viewport, much cheaper than the full screenshot
+def capture_hash(client,metrics):
+    thumbnail = client.send("Page.captureScreenshot", screenshot_params(metrics, THUMBNAIL_WIDTH, "png"))
+    return dhash(base64.b64decode(thumbnail["data"]))
+
+async def capture_hash_async(client,metrics):
+    thumbnail = await client.send("Page.captureScreenshot", screenshot_params(metrics, THUMBNAIL_WIDTH, "png"))
+    return dhash(base64.b64decode(thumbnail["data"]))
+
+#Whether two hashes are close enough to be the same page
+def same_page(hash_a,hash_b):
+    return bin(hash_a ^ hash_b).count("1") <= Settings.Vision_Hash_Distance
+
+
+def decode_png(data):
+    """
+    Decode an 8 bit, non interlaced PNG to grayscale.
+
+    Args:
+        data (bytes): The PNG file.
+
+    Returns:
+        tuple: The width, height and the rows of gray values(0-255).
+    """
+    if data[:8] != PNG_SIGNATURE:
+        raise ValueError("Not a PNG image")
+    position = 8
+    compressed = []
+    while position < len(data):
+        length, kind = struct.unpack(">I4s", data[position:position + 8])
+        chunk = data[position + 8:position + 8 + length]
+        position += length + 12
+        if kind == b"IHDR":
+            width, height, depth, color_type, _, _, interlace = struct.unpack(">IIBBBBB", chunk)
+            if depth != 8 or interlace or color_type not in PNG_CHANNELS:
+                raise ValueError("Only 8 bit, non interlaced PNGs are supported")
+            channels = PNG_CHANNELS[color_type]
+        elif kind == b"IDAT":
+            compressed.append(chunk)
+        elif kind == b"IEND":
+            break
+    raw = zlib.decompress(b"".join(compressed))
+    stride = width * channels
+    rows = []
+    previous = bytearray(stride)
+    for y in range(height):
+        start = y * (stride + 1)
+        row = unfilter(raw[start], bytearray(raw[start + 1:start + 1 + stride]), previous, channels)
+        if channels >= 3:
+            rows.append([(299 * row[x] + 587 * row[x + 1] + 114 * row[x + 2]) // 1000 for x in range(0, stride, channels)])
+        else:
+            rows.append(list(row[::channels]))
+        previous = row
+    return width, height, rows
+
+#Undo the PNG filter of a row in place
+def unfilter(filter_type, row, previous, bpp):
+    if filter_type == 1:
+        for i in range(bpp, len(row)):
+            row[i] = (row[i] + row[i - bpp]) & 0xFF
+    elif filter_type == 2:
+        for i in range(len(row)):
+            row[i] = (row[i] + previous[i]) & 0xFF
+    elif filter_type == 3:
+        for i in range(len(row)):
+            left = row[i - bpp] if i >= bpp else 0
+            row[i] = (row[i] + ((left + previous[i]) >> 1)) & 0xFF
+    elif filter_type == 4:
+        for i in range(len(row)):
+            left = row[i - bpp] if i >= bpp else 0
+            up_left = previous[i - bpp] if i >= bpp else 0
+            estimate = left + previous[i] - up_left
+            distances = (abs(estimate - left), abs(estimate - previous[i]), abs(estimate - up_left))
+            if distances[0] <= distances[1] and distances[0] <= distances[2]:
+                predictor = left
+            elif distances[1] <= distances[2]:
+                predictor = previous[i]
+            else:
+                predictor = up_left
+            row[i] = (row[i] + predictor) & 0xFF
+    return row
+
+
+#Pixel range of cell i when size pixels are split into count cells, never empty
+def cell_bounds(i,count,size):
+    start = i * size // count
+    return start, max((i + 1) * size // count, start + 1)
+
+
+def dhash(png):
+    """
+    Return the difference hash of a PNG, similar looking images get hashes a few bits apart.
+
+    Args:
+        png (bytes): The PNG file.
+
+    Returns:
+        int: The 64 bit hash.
+    """
+    width, height, rows = decode_png(png)
+    value = 0
+    for y in range(HASH_HEIGHT):
+        top, bottom = cell_bounds(y, HASH_HEIGHT, height)
+        cells = []
+        for x in range(HASH_WIDTH):
+            left, right = cell_bounds(x, HASH_WIDTH, width)
+            cells.append(sum(sum(rows[row][left:right]) / (right - left) for row in range(top, bottom)))
+        for x in range(HASH_WIDTH - 1):
+            value = value << 1 | (cells[x] < cells[x + 1])
+    return value
+
+
+class SummaryCache:
+    """
+    Page summaries of recent screenshots keyed by website and perceptual hash.
+
+    A screenshot whose hash is within max_distance bits of a cached one on the same website
+    reuses its summary, so repeated failures on an unchanged page skip the vision model.
+    The speculative vision worker puts summaries while the agent reads them, so both hold a lock.
+
+    Functions:
+    - get(website_name, image_hash): Return the summary of a similar screenshot or None.
+    - put(website_name, image_hash, summary): Cache a summary.
+    """
+
+    def __init__(self,max_entries,max_distance):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self,website_name,image_hash):
+        with self.lock:
+            for key, summary in reversed(self.entries.items()):
+                if key[0] == website_name and bin(key[1] ^ image_hash).count("1") <= self.max_distance:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return summary
+            self.misses += 1
+            return None
+
+    def put(self,website_name,image_hash,summary):
+        with self.lock:
+            self.entries[(website_name, image_hash)] = summary
+            self.entries.move_to_end((website_name, image_hash))
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
@@ -0,0 +1,68 @@
+from playwright.async_api import async_playwright
+import asyncio
+import sys
+import AsyncAccessibilityDriver
+import Settings
+
+
+async def run_sessions(tasks, sessions=None, on_result=None):
+    """
+    Run many tasks at once in a single Chromium process, each session in its own browser context.
+
+    Sessions take tasks from a shared queue. The number of Groq requests in flight across
+    all sessions is capped by Settings.Max_Concurrent_LLM(see LLMClients).
+
+    Args:
+        tasks (list): The tasks to run, each a dict with at least a "prompt" key.
+        sessions (int): The number of sessions to run at once(default is Settings.Max_Sessions).
+        on_result (function): Called with each result as soon as its task finishes.
+
+    Returns:
+        list: One result per task, the task merged with the result of run_task.
+    """
+    if sessions is None:
+        sessions = Settings.Max_Sessions
+    queue = asyncio.Queue()
+    for task in tasks:
+        queue.put_nowait(task)
+    results = []
+
+    async def worker(agent, browser):
+        await agent.open(browser)
+        try:
+            while not queue.empty():
+                task = queue.get_nowait()
+                try:
+                    result = await agent.run_task(task["prompt"])
+                except Exception as e:
+                    print(e)
+                    result = {"prompt": task["prompt"], "status": "error", "error": str(e)}
+                result = {**task, **result}
+                results.append(result)
+                if on_result is not None:
+                    on_result(result)
+        finally:
+            await agent.close()
+
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(channel="chrome", headless=Settings.Headless)
+        agents = [AsyncAccessibilityDriver.AsyncAgentBrowser() for n in range(max(1, min(sessions, len(tasks))))]
+        try:
+            await asyncio.gather(*(worker(agent, browser) for agent in agents))
+        finally:
+            await browser.close()
+    return results
+
+
+def main():
+    """
+    Run every line of a text file as a task: python SessionPool.py tasks.txt
+    """
+    with open(sys.argv[1]) as task_file:
+        tasks = [{"prompt": line.strip()} for line in task_file if line.strip()]
+    for result in asyncio.run(run_sessions(tasks)):
+        print(f"{result['status']}: {result['prompt']}")
+
+
+if __name__=="__main__":
+    main()
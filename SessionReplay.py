@@ -0,0 +1,330 @@
+from playwright.sync_api import sync_playwright
+import argparse
+import importlib
+import itertools
+import json
+import AccessibilityDriver
+import LLMAgent
+import PageReadiness
+import Settings
+import VisionAgent
+
+
+#LLM entry points whose responses are recorded, everything else the agent does goes through the page
+LLM_FUNCTIONS = [(LLMAgent, "prompt_groq"), (LLMAgent, "prompt_groq_stream"), (VisionAgent, "PromptVision")]
+#Decisions of the readiness waits that depend on the clock or on page events, their outcomes are recorded with the calls
+READINESS_FUNCTIONS = [(PageReadiness, "before_deadline"), (PageReadiness.NavigationWatch, "seen")]
+#Proxy id of the page the agent is given
+PAGE_ID = 0
+
+
+class ReplayMismatch(BaseException):
+    """
+    The agent made a call the recorded session did not, so the pipeline no longer matches the recording.
+
+    It is not an Exception so the agent's own error handling(e.g. ExecuteCommand turning any error into a
+    failed command) can not swallow it, the replay stops at the first call that differs.
+    """
+
+
+#Settings that are plain values, stored with a session so the replay runs the same pipeline
+def settings_snapshot():
+    snapshot = {}
+    for name, value in vars(Settings).items():
+        if name.startswith("_"):
+            continue
+        try:
+            json.dumps(value)
+        except (TypeError, ValueError):
+            continue
+        snapshot[name] = value
+    return snapshot
+
+#Turns off what would make the calls differ between recording and replay: background vision, CDP event driven patching and memoized commands
+def pin_settings():
+    Settings.UseSpeculativeVision = False
+    Settings.IncrementalTree = False
+    AccessibilityDriver.command_memo = None
+
+
+class Recorder:
+    """
+    Writes every call made on a live page, its CDP sessions and the LLM functions to a JSONL session file.
+
+    Results that are plain JSON are stored as is, anything else(element handles, the mouse, the CDP session)
+    is stored as a proxy id and wrapped so the calls made on it are recorded too.
+
+    Functions:
+    - wrap(value, target, name, kind): Record a result and return it, wrapped when it is not plain JSON.
+    - error(target, name, kind, error): Record a raised error.
+    - patch_llm(): Record the responses of the LLM functions and the outcomes of the readiness decisions.
+    """
+
+    def __init__(self,path,prompt):
+        self.file = open(path, "w", encoding="utf-8")
+        self.proxy_ids = itertools.count(PAGE_ID + 1)
+        self.originals = []
+        self.write({"type": "session", "prompt": prompt, "settings": settings_snapshot()})
+
+    def write(self,record):
+        self.file.write(json.dumps(record) + "\n")
+
+    def wrap(self,value,target,name,kind):
+        event = {"target": target, "name": name, "kind": kind}
+        try:
+            line = json.dumps({**event, "result": value})
+        except (TypeError, ValueError):
+            proxy_id = next(self.proxy_ids)
+            line = json.dumps({**event, "proxy": proxy_id})
+            value = RecordingProxy(self, value, proxy_id)
+        self.file.write(line + "\n")
+        return value
+
+    def error(self,target,name,kind,error):
+        error_type = type(error)
+        self.write({"target": target, "name": name, "kind": kind, "error": {
+            "module": error_type.__module__,
+            "type": error_type.__qualname__,
+            "message": str(error),
+        }})
+
+    def patch_llm(self):
+        for module, name in LLM_FUNCTIONS + READINESS_FUNCTIONS:
+            original = getattr(module, name)
+            self.originals.append((module, name, original))
+            setattr(module, name, self.recorded_function(module.__name__, name, original))
+
+    def recorded_function(self,target,name,function):
+        def recorded(*args, **kwargs):
+            try:
+                result = function(*args, **kwargs)
+            except Exception as e:
+                self.error(target, name, "call", e)
+                raise
+            return self.wrap(result, target, name, "call")
+        return recorded
+
+    def close(self,result=None):
+        for module, name, original in self.originals:
+            setattr(module, name, original)
+        if result is not None:
+            self.write({"type": "result", "result": result})
+        self.file.close()
+
+
+class RecordingProxy:
+    """
+    Passes every attribute and call through to the wrapped object and records the results.
+    """
+
+    def __init__(self,recorder,target,proxy_id):
+        self._recorder = recorder
+        self._target = target
+        self._id = proxy_id
+
+    def __getattr__(self,name):
+        value = getattr(self._target, name)
+        if not callable(value):
+            return self._recorder.wrap(value, self._id, name, "attr")
+
+        def call(*args, **kwargs):
+            #The real object gets the real arguments, e.g. new_cdp_session(page)
+            args = [arg._target if isinstance(arg, RecordingProxy) else arg for arg in args]
+            try:
+                result = value(*args, **kwargs)
+            except Exception as e:
+                self._recorder.error(self._id, name, "call", e)
+                raise
+            return self._recorder.wrap(result, self._id, name, "call")
+        return call
+
+
+class Player:
+    """
+    Serves the calls of a recorded session back in order, without a browser or an LLM.
+
+    Functions:
+    - take(target, name, kind): Return the result of the next recorded call, which has to be this one.
+    - patch_llm(): Answer the LLM functions and the readiness decisions from the recording.
+    """
+
+    def __init__(self,path):
+        with open(path, encoding="utf-8") as session_file:
+            records = [json.loads(line) for line in session_file if line.strip()]
+        self.header = records[0]
+        self.recorded_result = next((record["result"] for record in records if record.get("type") == "result"), None)
+        self.events = [record for record in records if "type" not in record]
+        self.position = 0
+        self.mismatch = None
+        self.originals = []
+
+    def peek(self):
+        return self.events[self.position] if self.position < len(self.events) else None
+
+    def take(self,target,name,kind):
+        #Cleanup code running while the mismatch unwinds(e.g. a finally block) gets the same error, so it is not replaced
+        if self.mismatch is not None:
+            raise self.mismatch
+        event = self.peek()
+        if event is None or event["target"] != target or event["name"] != name or event["kind"] != kind:
+            expected = "end of session" if event is None else f"{event['target']}.{event['name']}({event['kind']})"
+            self.mismatch = ReplayMismatch(f"Call {self.position}: recorded {expected}, replay made {target}.{name}({kind})")
+            raise self.mismatch
+        self.position += 1
+        if "error" in event:
+            raise rebuild_error(event["error"])
+        if "proxy" in event:
+            return ReplayProxy(self, event["proxy"])
+        return event["result"]
+
+    def patch_llm(self):
+        for module, name in LLM_FUNCTIONS + READINESS_FUNCTIONS:
+            self.originals.append((module, name, getattr(module, name)))
+            setattr(module, name, self.replayed_function(module.__name__, name))
+
+    def replayed_function(self,target,name):
+        def replayed(*args, **kwargs):
+            return self.take(target, name, "call")
+        return replayed
+
+    def rewind(self):
+        self.position = 0
+        self.mismatch = None
+
+    def close(self):
+        for module, name, original in self.originals:
+            setattr(module, name, original)
+
+
+class ReplayProxy:
+    """
+    Stands in for a recorded object, its attributes and calls are answered by the player.
+    """
+
+    def __init__(self,player,proxy_id):
+        self._player = player
+        self._id = proxy_id
+
+    def __getattr__(self,name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        event = self._player.peek()
+        if event is None or event["target"] != self._id or event["name"] != name:
+            #Neither a recorded attribute nor a recorded call of this name comes next
+            self._player.take(self._id, name, "attr")
+        if event["kind"] == "attr":
+            return self._player.take(self._id, name, "attr")
+
+        def call(*args, **kwargs):
+            return self._player.take(self._id, name, "call")
+        return call
+
+
+#The recorded error raised again, as its own class when it can be imported
+def rebuild_error(error):
+    try:
+        error_type = getattr(importlib.import_module(error["module"]), error["type"])
+        return error_type(error["message"])
+    except Exception:
+        return Exception(error["message"])
+
+
+def record(prompt,path):
+    """
+    Run a task live in Chrome with real LLM calls and record the session.
+
+    Args:
+        prompt (str): The task to run.
+        path (str): Where the session is written.
+
+    Returns:
+        dict: The result of the task.
+    """
+    pin_settings()
+    recorder = Recorder(path, prompt)
+    recorder.patch_llm()
+    result = None
+    try:
+        with sync_playwright() as p:
+            browser = p.chromium.launch(channel="chrome", headless=Settings.Headless)
+            page = RecordingProxy(recorder, browser.new_page(), PAGE_ID)
+            result = AccessibilityDriver.AgentBrowser(page=page).run_task(prompt)
+            browser.close()
+    finally:
+        recorder.close(result)
+    return result
+
+
+def replay(path,repeat=1):
+    """
+    Run a recorded session offline at full speed, the step times left are the framework's own overhead.
+
+    Args:
+        path (str): The recorded session.
+        repeat (int): The number of replays, the fastest time of each step counts.
+
+    Returns:
+        dict: The replayed result, with the fastest seconds of each step.
+    """
+    player = Player(path)
+    for name, value in player.header["settings"].items():
+        setattr(Settings, name, value)
+    pin_settings()
+    #Nothing changes between polls of a recording, so waiting between them only adds time
+    Settings.Ax_Poll_Ms = 0
+    player.patch_llm()
+    best = None
+    try:
+        for _ in range(repeat):
+            player.rewind()
+            result = AccessibilityDriver.AgentBrowser(page=ReplayProxy(player, PAGE_ID)).run_task(player.header["prompt"])
+            if best is None:
+                best = result
+            else:
+                for best_step, step in zip(best["trace"], result["trace"]):
+                    best_step["seconds"] = min(best_step["seconds"], step["seconds"])
+                best["seconds"] = min(best["seconds"], result["seconds"])
+    finally:
+        player.close()
+    report(best, player.recorded_result)
+    return best
+
+
+def report(result,recorded_result=None):
+    """
+    Print the framework seconds of each step, next to the live seconds when the recording has them.
+    """
+    live_steps = recorded_result["trace"] if recorded_result is not None else []
+    print(f"\n{'step':>4}  {'replay ms':>10}  {'live ms':>10}  command")
+    for n, step in enumerate(result["trace"]):
+        live = f"{live_steps[n]['seconds'] * 1000:>10.1f}" if n < len(live_steps) else f"{'':>10}"
+        print(f"{step['step']:>4}  {step['seconds'] * 1000:>10.1f}  {live}  {step['command'][:60]}")
+    live_total = f", live {recorded_result['seconds']:.3f}s" if recorded_result is not None else ""
+    print(f"\nStatus {result['status']}, framework {result['seconds']:.3f}s{live_total}")
+    print("Framework seconds per stage: " + json.dumps(result["timings"]))
+
+
+def main():
+    """
+    python SessionReplay.py record "task" session.jsonl  Run a task live and record it
+    python SessionReplay.py replay session.jsonl          Replay it offline and report the framework time per step
+    """
+    parser = argparse.ArgumentParser(description="Record and replay agent sessions")
+    commands = parser.add_subparsers(dest="command", required=True)
+    record_parser = commands.add_parser("record", help="Run a task live and record it")
+    record_parser.add_argument("prompt")
+    record_parser.add_argument("session")
+    replay_parser = commands.add_parser("replay", help="Replay a recorded session offline")
+    replay_parser.add_argument("session")
+    replay_parser.add_argument("--repeat", type=int, default=1, help="Replay several times and keep the fastest step times")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        result = record(args.prompt, args.session)
+        print(f"Recorded {result['status']} task to {args.session}")
+    else:
+        replay(args.session, args.repeat)
+
+
+if __name__=="__main__":
+    main()
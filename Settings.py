@@ -4,6 +4,12 @@ OnlyFocusable = True
 #Whether or not to use the full accessibility tree or just built in snapshot
 UseFullTree = True
 
+#Whether or not to patch the tree from CDP change events instead of refetching it after every command(Only used with UseFullTree)
+IncrementalTree = False
+
+#The max number of changed nodes patched in place before falling back to a full tree reload
+Incremental_Patch_Limit = 200
+
 #The max characters the tree can output
 Tree_Context_Cap = 16000
 
@@ -26,4 +32,142 @@ Max_Attempts = 5
 ShowTree = False
 
 #Whether or not to run the browser in headless mode(Only use after testing throughly)
-Headless = False
\ No newline at end of file
+Headless = False
+
+#Whether or not to reuse Groq responses for identical requests(Every request uses temperature 0)
+UseResponseCache = False
+
+#Where the response cache is stored
+Response_Cache_Path = "llm_cache.sqlite"
+
+#The max size of the response cache in megabytes, least recently used responses are evicted first
+Response_Cache_Max_MB = 50
+
+#The max age of a cached response in seconds
+Response_Cache_Max_Age = 7 * 24 * 60 * 60
+
+#The number of closest matching nodes returned by the Find command
+Find_Top_K = 10
+
+#The max number of Find commands for a single instruction before it counts as failed
+Max_Finds_Per_Step = 2
+
+#Whether or not to reuse commands resolved for the same instruction on the same website while the target node still exists
+UseCommandMemo = False
+
+#Where the command memo is stored
+Command_Memo_Path = "command_memo.sqlite"
+
+#Signals waited on after each command before the tree is refreshed, in order, any of "load", "networkidle", "dom" and "ax"
+Ready_Signals = ["load", "dom"]
+
+#The max seconds to wait for the page to be ready after a command
+Ready_Timeout = 5
+
+#The max seconds to wait for scrolled content to load
+Scroll_Ready_Timeout = 3
+
+#The max seconds to wait for the network to go idle(Some pages never do)
+Network_Idle_Timeout = 2
+
+#Milliseconds without DOM mutations before the page counts as settled
+Dom_Quiet_Ms = 300
+
+#Milliseconds between accessibility tree polls when waiting for it to stop changing
+Ax_Poll_Ms = 250
+
+#Whether or not to run the asyncio agent loop which loads the first page while the planner runs and fetches the tree and layout together
+UseAsync = False
+
+#The number of agent sessions run at once by SessionPool, each one gets its own browser context
+Max_Sessions = 4
+
+#The max number of Groq requests in flight at once across all sessions
+Max_Concurrent_LLM = 4
+
+#Whether or not to pack the tree nodes most relevant to each instruction into a token budget instead of outputting the top of the tree
+UseContextPacking = False
+
+#The max estimated tokens of a packed tree
+Tree_Token_Budget = 2000
+
+#The number of lines kept above and below each relevant node in a packed tree
+Context_Neighbors = 1
+
+#Whether or not to stream the command agent's response and stop it as soon as the command is complete
+UseCommandStreaming = False
+
+#The Groq API host(None uses https://api.groq.com), a local OpenAI compatible stub serving /openai/v1/chat/completions can stand in for it
+Groq_Base_URL = None
+
+#The OpenAI compatible endpoint of the vision model
+Vision_Base_URL = "http://localhost:1234/v1"
+
+#The max number of vision requests in flight at once(LM Studio runs one at a time)
+Vision_Max_Concurrent = 1
+
+#Seconds before an LLM request times out
+LLM_Timeout = 60
+
+#The number of times a rate limited, failed(5xx) or dropped LLM request is retried
+LLM_Max_Retries = 4
+
+#Seconds of the first retry backoff, it doubles with every retry and is jittered
+LLM_Backoff_Base = 0.5
+
+#The max seconds of a retry backoff
+LLM_Backoff_Max = 20
+
+#Seconds an idle LLM connection is kept open for reuse
+LLM_Keepalive = 30
+
+#The max width of the screenshots sent to the vision model, larger viewports are scaled down
+Screenshot_Max_Width = 1024
+
+#The JPEG quality of the screenshots sent to the vision model(0-100)
+Screenshot_Quality = 70
+
+#Whether or not to reuse the page summary of a similar looking screenshot on the same website
+UseVisionCache = True
+
+#The number of page summaries kept
+Vision_Cache_Size = 64
+
+#The max number of differing bits(of 64) between the hashes of two screenshots that count as the same page
+Vision_Hash_Distance = 4
+
+#Whether or not to summarize every new page in the background so a failed step finds its summary ready
+UseSpeculativeVision = False
+
+#Whether or not to record a span for every pipeline stage(planner, commands, tree, readiness, vision...)
+UseTracing = False
+
+#Where finished spans are appended as JSONL(None to not write them)
+Trace_Path = "trace.jsonl"
+
+#Where finished spans are streamed in the Chrome trace format(None to not write them), open it in https://ui.perfetto.dev
+Chrome_Trace_Path = "trace.json"
+
+#Whether or not to page the tree by what is on screen(from DOMSnapshot layout boxes) instead of 200 line chunks, every Scroll moves one screen down
+UseViewportPaging = False
+
+#Whether or not the command agent also resolves the next instructions it can do on the same tree in one response
+UseCommandBatching = False
+
+#The max number of commands in one command agent response
+Max_Batch_Commands = 3
+
+#Whether or not every agent tries the cheapest model of its list first and only asks the next one when the answer can not be used
+UseModelCascade = False
+
+#The models of the planner and plan updater cascade, cheapest first(without the cascade the last one is used)
+Planner_Models = ["llama3-8b-8192", "llama3-70b-8192"]
+
+#The models of the command agent cascade, cheapest first(without the cascade the first one is used)
+Command_Models = ["llama3-8b-8192", "llama3-70b-8192"]
+
+#Whether or not the command agent gets the full tree once per page and only the changes to it on later steps(the tree is not packed per instruction then)
+UseTreeDeltas = False
+
+#The max number of steps sent as changes to the same full tree before it is sent again
+Max_Delta_Steps = 10
\ No newline at end of file
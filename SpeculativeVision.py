@@ -0,0 +1,85 @@
+from concurrent.futures import ThreadPoolExecutor
+import ScreenCapture
+import Tracing
+import VisionAgent
+
+
+class SpeculativeVision:
+    """
+    Summarizes the current page in a background thread after every page change, so a failed step
+    finds its page summary ready(or underway) instead of starting the vision model from scratch.
+
+    Screenshots are taken on the calling thread since the sync Playwright API is not thread safe,
+    only the vision call runs in the background. A queued job for a page that changed again is
+    cancelled, a running one is left to finish and only fills the summary cache.
+
+    Functions:
+    - page_changed(client, website_name): Start summarizing the page unless it looks unchanged.
+    - summary(website_name, image_hash): Wait for and return the summary of a page, None if it was not summarized.
+    """
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="vision")
+        self.website_name = None
+        self.image_hash = None
+        self.job = None
+
+    def page_changed(self,client,website_name):
+        metrics = client.send("Page.getLayoutMetrics")
+        image_hash = ScreenCapture.capture_hash(client, metrics)
+        if self.matches(website_name, image_hash):
+            return
+        if self.job is not None:
+            self.job.cancel()
+        image = ScreenCapture.capture_image(client, metrics)
+        self.website_name = website_name
+        self.image_hash = image_hash
+        self.job = self.executor.submit(Tracing.call_in_lane, VisionAgent.PromptVision, image, website_name, image_hash)
+
+    def matches(self,website_name,image_hash):
+        return self.job is not None and self.website_name == website_name and ScreenCapture.same_page(self.image_hash, image_hash)
+
+    def summary(self,website_name,image_hash):
+        if not self.matches(website_name, image_hash) or self.job.cancelled():
+            return None
+        try:
+            return self.job.result()
+        except Exception as e:
+            print(f"Background page summary failed: {e!r}")
+            self.job = None
+            return None
+
+
+class AsyncSpeculativeVision(SpeculativeVision):
+    """
+    Async version of SpeculativeVision, the summary runs as an asyncio task which is cancelled outright when the page changes again.
+    """
+
+    def __init__(self):
+        self.website_name = None
+        self.image_hash = None
+        self.job = None
+
+    async def page_changed(self,client,website_name):
+        metrics = await client.send("Page.getLayoutMetrics")
+        image_hash = await ScreenCapture.capture_hash_async(client, metrics)
+        if self.matches(website_name, image_hash):
+            return
+        if self.job is not None:
+            self.job.cancel()
+        image = await ScreenCapture.capture_image_async(client, metrics)
+        self.website_name = website_name
+        self.image_hash = image_hash
+        self.job = Tracing.create_task(VisionAgent.PromptVisionAsync(image, website_name, image_hash))
+        #A summary nobody waits for may fail quietly
+        self.job.add_done_callback(lambda job: job.cancelled() or job.exception())
+
+    async def summary(self,website_name,image_hash):
+        if not self.matches(website_name, image_hash) or self.job.cancelled():
+            return None
+        try:
+            return await self.job
+        except Exception as e:
+            print(f"Background page summary failed: {e!r}")
+            self.job = None
+            return None
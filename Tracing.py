@@ -0,0 +1,272 @@
+from contextvars import ContextVar
+import asyncio
+import atexit
+import itertools
+import json
+import sys
+import threading
+import time
+import Settings
+
+
+#Whether spans are recorded, read once so disabled tracing costs a single check per span
+enabled = Settings.UseTracing
+#Finished spans not yet written to the traces
+pending = []
+#The Chrome trace being written, opened with the first span
+chrome_file = None
+trace_start = time.perf_counter()
+span_ids = itertools.count(1)
+lane_ids = itertools.count(1)
+write_lock = threading.Lock()
+#The innermost open span and the lane(track in the trace viewer) of the current thread or asyncio task
+current_span = ContextVar("current_span", default=None)
+current_lane = ContextVar("current_lane", default=0)
+
+
+class Span:
+    """
+    A timed stage of the pipeline with attributes, open while its with block runs.
+
+    Functions:
+    - set(**attributes): Set attributes of the span.
+    - count(name, n): Add n to a counter attribute of the span.
+    """
+    __slots__ = ("id", "name", "parent", "lane", "start", "end", "attributes", "token")
+
+    def __init__(self,name,attributes):
+        self.id = next(span_ids)
+        self.name = name
+        self.parent = current_span.get()
+        self.lane = current_lane.get()
+        self.attributes = attributes
+        self.start = None
+        self.end = None
+        self.token = None
+
+    def set(self,**attributes):
+        self.attributes.update(attributes)
+
+    def count(self,name,n=1):
+        self.attributes[name] = self.attributes.get(name, 0) + n
+
+    def __enter__(self):
+        self.token = current_span.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self,error_type,error,traceback):
+        self.end = time.perf_counter()
+        current_span.reset(self.token)
+        if error is not None:
+            self.attributes["error"] = repr(error)
+        finish(self)
+        return False
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "parent": None if self.parent is None else self.parent.id,
+            "lane": self.lane,
+            "name": self.name,
+            "start": round(self.start - trace_start, 6),
+            "seconds": round(self.end - self.start, 6),
+            "attributes": self.attributes,
+        }
+
+
+class NullSpan:
+    """
+    Stands in for a span when tracing is off, every method does nothing.
+    """
+    __slots__ = ()
+
+    def set(self,**attributes):
+        pass
+
+    def count(self,name,n=1):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,error_type,error,traceback):
+        return False
+
+NULL_SPAN = NullSpan()
+
+
+def span(name,**attributes):
+    """
+    Return a span to time a with block, e.g. with Tracing.span("planner", model=name) as s: ...
+
+    Args:
+        name (str): The stage the span times.
+        **attributes: Attributes of the span.
+
+    Returns:
+        Span: The span, or a span that records nothing when tracing is off.
+    """
+    if not enabled:
+        return NULL_SPAN
+    return Span(name, attributes)
+
+
+def record(name,start,**attributes):
+    """
+    Record a span that started at a perf_counter value and ends now, for stages that are not a single with block.
+
+    Args:
+        name (str): The stage the span times.
+        start (float): perf_counter value when the stage started.
+        **attributes: Attributes of the span.
+    """
+    if not enabled:
+        return
+    recorded = Span(name, attributes)
+    recorded.start = start
+    recorded.end = time.perf_counter()
+    finish(recorded)
+
+
+#Attributes set on and counters added to the innermost open span
+def annotate(**attributes):
+    if enabled and current_span.get() is not None:
+        current_span.get().set(**attributes)
+
+def count(name,n=1):
+    if enabled and current_span.get() is not None:
+        current_span.get().count(name, n)
+
+#Put the spans of the current thread or task, and the tasks it starts, on a new lane
+def new_lane():
+    if enabled:
+        current_lane.set(next(lane_ids))
+        current_span.set(None)
+
+#asyncio.create_task on a lane of its own, for a task that runs alongside the code that started it
+def create_task(coroutine):
+    if not enabled:
+        return asyncio.create_task(coroutine)
+    token = current_lane.set(next(lane_ids))
+    try:
+        return asyncio.create_task(coroutine)
+    finally:
+        current_lane.reset(token)
+
+#Call a function on a lane of its own, for a job run by a worker thread
+def call_in_lane(function,*args):
+    if enabled:
+        current_lane.set(next(lane_ids))
+        current_span.set(None)
+    return function(*args)
+
+def finish(finished):
+    with write_lock:
+        pending.append(finished)
+        if finished.parent is None:
+            flush()
+
+
+def flush():
+    """
+    Write the finished spans to Settings.Trace_Path as JSONL, one span per line, and to Settings.Chrome_Trace_Path as Chrome trace events.
+
+    Spans are not kept after they are written, so a long run holds only the spans of its open root spans.
+    """
+    global chrome_file
+    if not pending:
+        return
+    records = [pending_span.to_dict() for pending_span in pending]
+    pending.clear()
+    if Settings.Trace_Path is not None:
+        with open(Settings.Trace_Path, "a", encoding="utf-8") as trace_file:
+            for record in records:
+                trace_file.write(json.dumps(record, default=str) + "\n")
+    if Settings.Chrome_Trace_Path is not None:
+        #The JSON array format may be left unclosed, so the trace opens even if the process did not exit cleanly
+        if chrome_file is None:
+            chrome_file = open(Settings.Chrome_Trace_Path, "w", encoding="utf-8")
+            chrome_file.write("[\n")
+        for record in records:
+            chrome_file.write(json.dumps(chrome_event(record), default=str) + ",\n")
+        chrome_file.flush()
+
+
+#A span record as a complete("X") Chrome trace event, one thread per lane
+def chrome_event(record):
+    return {
+        "name": record["name"],
+        "cat": "agent",
+        "ph": "X",
+        "ts": round(record["start"] * 1e6, 3),
+        "dur": round(record["seconds"] * 1e6, 3),
+        "pid": 1,
+        "tid": record["lane"],
+        "args": record["attributes"],
+    }
+
+
+def chrome_trace(records):
+    """
+    Convert span records to the Chrome trace event format, which Perfetto and chrome://tracing open.
+
+    Args:
+        records (list): Span dicts as written to the JSONL trace.
+
+    Returns:
+        dict: The trace with one complete("X") event per span, one thread per lane.
+    """
+    return {"traceEvents": [chrome_event(record) for record in records], "displayTimeUnit": "ms"}
+
+
+def close():
+    """
+    Write the spans still pending and close the Chrome trace.
+    """
+    global chrome_file
+    with write_lock:
+        flush()
+        if chrome_file is not None:
+            #A process name metadata event ends the array without a trailing comma
+            chrome_file.write(json.dumps({"name": "process_name", "ph": "M", "pid": 1, "args": {"name": "agent"}}) + "]\n")
+            chrome_file.close()
+            chrome_file = None
+
+
+class TracedCDPSession:
+    """
+    Wraps a CDP session and counts every command sent through it on the current span.
+    """
+
+    def __init__(self,client):
+        self.client = client
+
+    def send(self,method,params=None):
+        count("cdp_calls")
+        return self.client.send(method, params)
+
+    def __getattr__(self,name):
+        return getattr(self.client, name)
+
+#The CDP session wrapped to count its calls, or as is when tracing is off
+def trace_cdp(client):
+    return TracedCDPSession(client) if enabled else client
+
+
+if enabled:
+    atexit.register(close)
+
+
+def main():
+    """
+    Convert a JSONL trace to a Chrome trace: python Tracing.py trace.jsonl trace.json
+    """
+    with open(sys.argv[1], encoding="utf-8") as trace_file:
+        records = [json.loads(line) for line in trace_file if line.strip()]
+    with open(sys.argv[2], "w", encoding="utf-8") as chrome_file:
+        json.dump(chrome_trace(records), chrome_file, default=str)
+
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,96 @@
+import Settings
+
+
+#The line of every shown node of the tree that has a backendDOMNodeId, by that id
+def node_lines(tree):
+    return {node.backend_id: tree.node_line(node).strip() for node, _level in tree.iter_shown(tree.full_tree) if node.backend_id is not None}
+
+
+#The part of the page the output shows, a Scroll moves it and the full tree is sent again
+def output_position(tree):
+    return tree.chunk_index, tree.viewport[0] if tree.viewport is not None else None
+
+
+#The lines of the nodes of the current chunk that were sent whole in the tree output, by backendDOMNodeId
+#The output may have been cut at Settings.Tree_Context_Cap, and its first line starts with the website name
+def sent_node_lines(tree,tree_view):
+    view_lines = [line.strip() for line in tree_view.split("\n")]
+    first_line = view_lines[0] if view_lines else ""
+    view_lines = set(view_lines)
+    sent_lines = {}
+    for node in tree.chunk_nodes():
+        line = tree.node_line(node).strip()
+        if node.backend_id is not None and (line in view_lines or first_line.endswith(line)):
+            sent_lines[node.backend_id] = line
+    return sent_lines
+
+
+def tree_delta(sent_lines,tree):
+    """
+    Compare the nodes of a tree output that was sent with the current tree by their backendDOMNodeId.
+
+    Args:
+        sent_lines (dict): The lines of the nodes in the output that was sent, by backendDOMNodeId.
+        tree (AccessibilityTree): The current tree, its output was taken for this step.
+
+    Returns:
+        tuple: The lines of nodes of the current output that were not sent, the lines of sent nodes that are no longer
+        in the tree and the (old, new) line pairs of sent nodes whose line changed.
+    """
+    current = node_lines(tree)
+    added = [current[node.backend_id] for node in tree.chunk_nodes() if node.backend_id is not None and node.backend_id not in sent_lines]
+    removed = [line for backend_id, line in sent_lines.items() if backend_id not in current]
+    renamed = [(line, current[backend_id]) for backend_id, line in sent_lines.items() if backend_id in current and current[backend_id] != line]
+    return added, removed, renamed
+
+
+#The changes as lines marked + added, - removed and ~ renamed(old -> new)
+def format_delta(added,removed,renamed):
+    if not added and not removed and not renamed:
+        return "No changes to the accessibility tree since it was sent"
+    lines = ["Changes to the accessibility tree since it was sent:"]
+    lines.extend("+ " + line for line in added)
+    lines.extend("- " + line for line in removed)
+    lines.extend(f"~ {old} -> {new}" for old, new in renamed)
+    return "\n".join(lines)
+
+
+class TreeConversation:
+    """
+    The command agent's conversation on the current page, the full tree is sent once and later steps only send what changed.
+
+    Every request is the full tree that was sent last followed by the changes since then and the step, so the history
+    stays the same size and its prefix can be reused by prompt caching. The full tree is sent again after navigation,
+    after a Scroll, after Settings.Max_Delta_Steps deltas, and when the delta would be more than half the size of the tree.
+
+    Functions:
+    - prompt(url, tree, tree_view, step_prompt): Return the history and the message of the next request.
+    - reset(): Send the full tree on the next step.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def prompt(self,url,tree,tree_view,step_prompt):
+        delta = None
+        position = output_position(tree)
+        if url == self.url and position == self.position and self.baseline is not None and self.deltas < Settings.Max_Delta_Steps:
+            delta = format_delta(*tree_delta(self.sent_lines, tree))
+            if len(delta) > len(tree_view) / 2:
+                delta = None
+        if delta is None:
+            self.url = url
+            self.position = position
+            self.baseline = {"role": "user", "content": tree_view}
+            self.sent_lines = sent_node_lines(tree, tree_view)
+            self.deltas = 0
+            return [self.baseline], step_prompt.lstrip()
+        self.deltas += 1
+        return [self.baseline], delta + step_prompt
+
+    def reset(self):
+        self.url = None
+        self.position = None
+        self.baseline = None
+        self.sent_lines = {}
+        self.deltas = 0
@@ -1,24 +1,45 @@
 # Adapted from OpenAI's Vision example
-from openai import OpenAI
 import base64
+import LLMClients
+import ScreenCapture
+import Settings
 
-# Point to the local server
-client = OpenAI(base_url="http://localhost:1234/v1", api_key="lm-studio")
+# The local server is Settings.Vision_Base_URL
 
-#path = input("Enter a local filepath to an image: ")
+#Summaries of recent screenshots, a failure on an unchanged page reuses the last one
+summary_cache = ScreenCapture.SummaryCache(Settings.Vision_Cache_Size, Settings.Vision_Hash_Distance) if Settings.UseVisionCache else None
 
-def PromptVision(path,website_name):
+def PromptVision(image,website_name,image_hash=None):
+  cached = cached_summary(website_name,image_hash)
+  if cached is not None:
+    return cached
+  completion = LLMClients.vision_provider.complete(vision_request(image,website_name))
+  return store_summary(website_name,image_hash,completion.choices[0].message.content)
 
-  # Read the image and encode it to base64:
-  base64_image = ""
-  try:
-    image = open(path.replace("'", ""), "rb").read()
-    base64_image = base64.b64encode(image).decode("utf-8")
-  except Exception:
-    print("Couldn't read the image. Make sure the path is correct and the file exists.")
-    exit()
+async def PromptVisionAsync(image,website_name,image_hash=None):
+  cached = cached_summary(website_name,image_hash)
+  if cached is not None:
+    return cached
+  completion = await LLMClients.vision_provider.complete_async(vision_request(image,website_name))
+  return store_summary(website_name,image_hash,completion.choices[0].message.content)
 
-  completion = client.chat.completions.create(
+def cached_summary(website_name,image_hash):
+  if summary_cache is None or image_hash is None:
+    return None
+  return summary_cache.get(website_name,image_hash)
+
+def store_summary(website_name,image_hash,summary):
+  if summary_cache is not None and image_hash is not None:
+    summary_cache.put(website_name,image_hash,summary)
+  return summary
+
+def vision_request(image,website_name):
+
+  # Encode the screenshot bytes to base64:
+  base64_image = base64.b64encode(image).decode("utf-8")
+  mime_type = "image/png" if image.startswith(ScreenCapture.PNG_SIGNATURE) else "image/jpeg"
+
+  return dict(
     model="xtuner/llava-phi-3-mini-gguf",
     messages=[
       {
@@ -38,7 +59,7 @@ def PromptVision(path,website_name):
           {
             "type": "image_url",
             "image_url": {
-              "url": f"data:image/jpeg;base64,{base64_image}"
+              "url": f"data:{mime_type};base64,{base64_image}"
             },
           },
         ],
@@ -50,4 +71,3 @@ def PromptVision(path,website_name):
     stream=False,
     stop="<|end|>"
   )
-  return completion.choices[0].message.content
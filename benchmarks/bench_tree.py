@@ -0,0 +1,250 @@
+"""
+Micro-benchmarks of the AccessibilityTree hot paths on synthetic trees, no browser or network needed.
+
+    python benchmarks/bench_tree.py                    Run and compare against benchmarks/baseline.json
+    python benchmarks/bench_tree.py --update-baseline  Run and store the results as the new baseline
+    python benchmarks/bench_tree.py --sizes 1000 10000 Only run some tree sizes
+
+The exit code is 1 when an operation got slower than --threshold times its baseline.
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import AccessibilityTree
+import Settings
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+SIZES = [1000, 10000, 50000, 200000]
+#Tree shapes as (name, depth, share of focusable nodes)
+SHAPES = [("shallow", 4, 0.3), ("deep", 16, 0.1)]
+ROLES = ["generic", "StaticText", "paragraph", "heading", "list", "listitem", "image"]
+FOCUSABLE_ROLES = ["link", "button", "textbox", "combobox", "checkbox"]
+WORDS = "home search news sports account login cart menu video comment share next more help about contact".split()
+LOOKUPS = 10000
+#Timings below this many seconds are too noisy to count as a regression
+MIN_SECONDS = 0.002
+
+
+class FakeCDPSession:
+    """
+    Serves a synthetic accessibility tree the way Chromium's CDP session would.
+    """
+
+    def __init__(self,nodes):
+        self.nodes = nodes
+        self.by_id = {node["nodeId"]: node for node in nodes}
+        self.calls = 0
+
+    def send(self,method,params=None):
+        self.calls += 1
+        #CDP responses are parsed into fresh dicts on every call
+        if method == "Accessibility.getFullAXTree":
+            return {"nodes": [dict(node) for node in self.nodes]}
+        if method == "Accessibility.getChildAXNodes":
+            node = self.by_id[params["id"]]
+            return {"nodes": [dict(self.by_id[child_id]) for child_id in node["childIds"]]}
+        return {}
+
+
+def make_nodes(count,depth,focusable_ratio,seed=0):
+    """
+    Build a getFullAXTree node list of a tree with count nodes and about the given depth.
+
+    Args:
+        count (int): The number of nodes.
+        depth (int): The depth of the tree.
+        focusable_ratio (float): The share of nodes that are focusable.
+        seed (int): Seed of the random names and roles.
+
+    Returns:
+        list: The nodes in document order, the root first.
+    """
+    rng = random.Random(seed)
+    branching = max(2, round(count ** (1 / depth)))
+    nodes = [{
+        "nodeId": "1",
+        "ignored": False,
+        "role": {"type": "role", "value": "RootWebArea"},
+        "name": {"type": "computedString", "value": "Benchmark page"},
+        "properties": [{"name": "focusable", "value": {"type": "booleanOrUndefined", "value": True}}],
+        "childIds": [],
+        "backendDOMNodeId": 1,
+    }]
+    parent = 0
+    while len(nodes) < count:
+        for _ in range(branching):
+            if len(nodes) >= count:
+                break
+            focusable = rng.random() < focusable_ratio
+            node_id = str(len(nodes) + 1)
+            node = {
+                "nodeId": node_id,
+                "ignored": rng.random() < 0.05,
+                "role": {"type": "role", "value": rng.choice(FOCUSABLE_ROLES if focusable else ROLES)},
+                "name": {"type": "computedString", "value": " ".join(rng.choices(WORDS, k=rng.randint(1, 4))) + " " + node_id},
+                "properties": [{"name": "focusable", "value": {"type": "booleanOrUndefined", "value": True}}] if focusable else [],
+                "parentId": nodes[parent]["nodeId"],
+                "childIds": [],
+                "backendDOMNodeId": len(nodes) + 1,
+            }
+            nodes[parent]["childIds"].append(node_id)
+            nodes.append(node)
+        parent += 1
+    return nodes
+
+
+#A page.accessibility.snapshot() like snapshot listing every focusable node
+def make_snapshot(nodes):
+    return {"role": "WebArea", "name": "Benchmark page", "children": [
+        {"role": node["role"]["value"], "name": node["name"]["value"]}
+        for node in nodes[1:]
+        if node["properties"]
+    ]}
+
+
+def measure(operation,repeat):
+    """
+    Time an operation and measure the memory it allocates.
+
+    Args:
+        operation (function): The operation, called without arguments.
+        repeat (int): The number of timed runs, the fastest counts.
+
+    Returns:
+        dict: The seconds of the fastest run, the peak KB allocated by one run and the KB still held after it.
+    """
+    best = None
+    for _ in range(repeat):
+        #Collections triggered by earlier runs would land on random runs, like timeit they are kept out
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            operation()
+            elapsed = time.perf_counter() - start
+        finally:
+            gc.enable()
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    #The result is kept until the memory is read, so an operation that builds something reports its size as retained
+    result = operation()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return {"seconds": round(best, 6), "peak_kb": round(peak / 1024, 1), "retained_kb": round(retained / 1024, 1)}
+
+
+def run_case(count,depth,focusable_ratio):
+    """
+    Run every benchmarked operation on one synthetic tree.
+
+    Returns:
+        dict: Operation name to its measurement.
+    """
+    nodes = make_nodes(count, depth, focusable_ratio)
+    snapshot = make_snapshot(nodes)
+    client = FakeCDPSession(nodes)
+    repeat = 5 if count <= 50000 else 3
+    Settings.UseFullTree = True
+    Settings.OnlyFocusable = True
+    tree = AccessibilityTree.AccessibilityTree(client, None)
+    ids = [node["backendDOMNodeId"] for node in random.Random(1).choices(nodes, k=LOOKUPS)]
+    tree_nodes = list(tree.ax_nodes.values())
+
+    def cold_output():
+        tree.tree_changed()
+        tree.chunk_index = 0
+        tree.get_output(Settings.Tree_Context_Cap)
+
+    def cold_string():
+        tree.tree_changed()
+        tree.to_string(tree.full_tree)
+
+    def lookups():
+        for node_id in ids:
+            tree.getNodeByDomId(node_id)
+
+    def focusable():
+        for node in tree_nodes:
+            tree.is_focusable(node)
+
+    results = {
+        "new_tree": measure(lambda: AccessibilityTree.AccessibilityTree(client, None), repeat),
+        "load_tree": measure(lambda: tree.load_tree(None), repeat),
+        "to_string": measure(cold_string, repeat),
+        "get_output": measure(cold_output, repeat),
+        "get_output_warm": measure(lambda: tree.get_output(Settings.Tree_Context_Cap), repeat),
+        f"getNodeByDomId_x{LOOKUPS}": measure(lookups, repeat),
+        "getStartPage": measure(lambda: tree.getStartPage(snapshot, tree_nodes), repeat),
+        "is_focusable_all": measure(focusable, repeat),
+    }
+    Settings.OnlyFocusable = False
+    results["load_tree_all_nodes"] = measure(lambda: tree.load_tree(None), repeat)
+    Settings.OnlyFocusable = True
+    return results
+
+
+def compare(results,baseline,threshold):
+    """
+    Print every measurement next to its baseline and return the regressions.
+
+    Returns:
+        list: Descriptions of the operations slower than threshold times their baseline.
+    """
+    regressions = []
+    for case, operations in results.items():
+        print(f"\n{case}")
+        for operation, current in operations.items():
+            previous = baseline.get(case, {}).get(operation)
+            line = f"  {operation:<26}{current['seconds'] * 1000:>10.2f} ms{current['peak_kb']:>12.1f} KB peak{current['retained_kb']:>12.1f} KB held"
+            if previous is not None:
+                ratio = current["seconds"] / previous["seconds"] if previous["seconds"] else 1.0
+                line += f"   x{ratio:.2f} of baseline"
+                if ratio > threshold and current["seconds"] - previous["seconds"] > MIN_SECONDS:
+                    line += "  REGRESSION"
+                    regressions.append(f"{case} {operation}: x{ratio:.2f}")
+            print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AccessibilityTree micro-benchmarks")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="Tree sizes to run")
+    parser.add_argument("--threshold", type=float, default=2.0, help="Slowdown against the baseline that counts as a regression")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline JSON file")
+    parser.add_argument("--update-baseline", action="store_true", help="Store the results as the new baseline")
+    args = parser.parse_args()
+
+    results = {}
+    for count in args.sizes:
+        for shape, depth, focusable_ratio in SHAPES:
+            case = f"{shape}_{count}"
+            print(f"Running {case}...", flush=True)
+            results[case] = run_case(count, depth, focusable_ratio)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+    regressions = compare(results, baseline, args.threshold)
+
+    if args.update_baseline:
+        baseline.update(results)
+        with open(args.baseline, "w", encoding="utf-8") as baseline_file:
+            json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+        print(f"\nBaseline written to {args.baseline}")
+    elif regressions:
+        print("\nRegressions:\n  " + "\n  ".join(regressions))
+        sys.exit(1)
+
+
+if __name__=="__main__":
+    main()
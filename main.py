@@ -1,7 +1,22 @@
+import argparse
 import AccessibilityDriver
+import AsyncAccessibilityDriver
+import BatchRunner
+import Settings
 
 def main():
-    AccessibilityDriver.AgentBrowser()
+    parser = argparse.ArgumentParser(description="LLM web agent")
+    parser.add_argument("--batch", help="Run the tasks of a JSONL file headless instead of prompting for them")
+    parser.add_argument("--output", default="results.jsonl", help="Where batch results are appended, finished tasks in it are skipped")
+    parser.add_argument("--sessions", type=int, default=None, help="The number of batch tasks run at once")
+    args = parser.parse_args()
+
+    if args.batch is not None:
+        BatchRunner.run_batch(args.batch, args.output, args.sessions)
+    elif Settings.UseAsync:
+        AsyncAccessibilityDriver.run()
+    else:
+        AccessibilityDriver.AgentBrowser()
 
 if __name__=="__main__":
     main()
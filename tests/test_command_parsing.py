@@ -0,0 +1,46 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import LLMAgent
+
+
+def test_nested_parentheses_are_not_cut():
+    text = "Thought:\nType it in\nCommand: Input(22, Hello (world))"
+    assert not LLMAgent.command_complete(text)
+    assert not LLMAgent.command_complete(text[:-1] + "\n")
+    assert LLMAgent.command_complete(text + "\n")
+    assert LLMAgent.parse_commands(text) == ["Input(22, Hello (world))"]
+
+
+def test_command_mentioned_in_thought_is_skipped():
+    text = "Thought:\nI could use command: Click(5) but 88 fits better\n"
+    assert not LLMAgent.command_complete(text)
+    text += "Command: Click(88)\n"
+    assert LLMAgent.command_complete(text)
+    assert LLMAgent.parse_commands(text) == ["Click(88)"]
+
+
+def test_exception_at_end_of_stream():
+    text = "Thought:\nNothing matches\nCommand:\nException: Could not find the node"
+    assert not LLMAgent.command_complete(text)
+    assert LLMAgent.parse_commands(text) == ["Exception: Could not find the node"]
+    assert LLMAgent.command_complete(text + "\n")
+
+
+def test_batched_commands_are_counted_when_complete():
+    text = "Thought:\nBoth are here\nCommand: `Input(22,Burger)`\n**Command:** Enter()"
+    assert not LLMAgent.commands_complete(2)(text)
+    assert LLMAgent.commands_complete(2)(text + "\n")
+    assert LLMAgent.parse_commands(text) == ["Input(22,Burger)", "Enter()"]
+
+
+def test_whole_response_without_title_at_line_start():
+    assert LLMAgent.parse_commands("Thought: 88 is the login button Command: Click(88)") == ["Click(88)"]
+    assert LLMAgent.parse_commands("Thought:\nClick it\n1. Command: Click(88)") == ["Click(88)"]
+    assert not LLMAgent.command_complete("Thought: 88 is the login button Command: Click(88)\n")
+
+
+def test_unbalanced_text_is_kept_when_finished():
+    text = "Thought:\nType the review\nCommand: Input(22, I love it :))"
+    assert LLMAgent.parse_commands(text) == ["Input(22, I love it :))"]